@@ -0,0 +1,420 @@
+from constants import (
+    IK_CONST,
+    IK_ADD,
+    IK_WRITE,
+    IK_CALL,
+    IK_JUMP,
+    IK_BRANCH,
+    IK_RETURN,
+    IK_EXIT,
+    IK_END,
+    IK_COUNT,
+    IK_ARGUMENT,
+    IK_PARALLEL,
+    INTEGER_SIZE,
+)
+from ir import INVERSE_CONDITIONS
+from utils import error
+
+# the routines every output and exit calls with -Os, instead of repeating the
+# syscall setup. Only the arguments that change are set by the caller
+RUNTIME_HELPERS = {
+    '__sas_write': [
+        'mov rax,0x01',
+        'mov rdi,0x01',
+        'syscall',
+        'ret',
+    ],
+    '__sas_writev': [
+        'mov rax,0x14',
+        'mov rdi,0x01',
+        'syscall',
+        'ret',
+    ],
+    '__sas_exit': [
+        'mov rax,0x3c',
+        'syscall',
+    ],
+}
+
+# the stack of every thread of a parallel loop, workers only keep their
+# registers there
+THREAD_STACK_SIZE = 64 * 1024
+# CLONE_VM | CLONE_FS | CLONE_FILES | CLONE_SIGHAND | CLONE_THREAD |
+# CLONE_SYSVSEM | CLONE_CHILD_CLEARTID
+CLONE_FLAGS = 0x250f00
+# where workers get their arguments. rdi points to the end of their output
+ARGUMENT_REGISTERS = ('r12', 'r13')
+# the routines of runtime/runtime.asm, linked into every program
+RUNTIME_LIBRARY = ('__sas_format_int', '__sas_append_int')
+
+
+class Backend:
+    """turns IR functions into x86_64 assembly. Every virtual register gets
+    its own stack slot in the frame of the function.
+
+    context provides label(prefix) and get_text_reference(text) for the names
+    of labels and data, add_data(name, line) for everything else in .data,
+    add_bss(name, line) for .bss, emit_exit(code, fd) and counters_label for
+    profile instrumentation, and use_helper(name) to ask for one of the
+    RUNTIME_HELPERS"""
+    def __init__(self, context, optimize_size=False):
+        self.context = context
+        # -Os: outputs go through the shared helpers of RUNTIME_HELPERS
+        self.optimize_size = optimize_size
+
+    def slot(self, register):
+        if register == 0:
+            return 'qword [rsp]'
+
+        return f'qword [rsp+{register * 8}]'
+
+    def operand(self, value, fd):
+        """instructions only take 32 bit immediates, bigger values go through rax"""
+        if -2**31 <= value < 2**31:
+            return value
+
+        fd.append(f'mov rax,{value}')
+
+        return 'rax'
+
+    def emit_format(self, register, end, fd):
+        """formats a register in decimal right before end, leaving the first
+        char in rax and the size in rdx"""
+        fd.append(f'mov rdi,{self.slot(register)}')
+        fd.append(f'mov rsi,{end}')
+        fd.append('call __sas_format_int')
+
+    def emit_write(self, pieces, fd, buffered=False):
+        """buffered writes append to the output of a worker, at rdi"""
+        buffers = []
+
+        for piece in pieces:
+            # registers have no size until they are formatted
+            if isinstance(piece, int):
+                buffers.append((piece, None))
+                continue
+
+            size = len(piece.encode('utf-8'))
+
+            if size > 0:
+                buffers.append((self.context.get_text_reference(piece), size))
+
+        if len(buffers) == 0:
+            return
+
+        if buffered:
+            for string_data_name, size in buffers:
+                if size is None:
+                    fd.append(f'mov rsi,{self.slot(string_data_name)}')
+                    fd.append('call __sas_append_int')
+                    continue
+
+                fd.append(f'mov rsi,{string_data_name}')
+                fd.append(f'mov rcx,{size}')
+                fd.append('rep movsb')
+            return
+
+        integers = [index for index, (_, size) in enumerate(buffers) if size is None]
+        digits = None
+
+        if len(integers) > 0:
+            digits = self.context.label('digits')
+            self.context.add_bss(digits, f'{digits} resb {INTEGER_SIZE * len(integers)}')
+
+        if len(buffers) == 1 and len(integers) == 1:
+            self.emit_format(buffers[0][0], f'{digits}+{INTEGER_SIZE}', fd)
+            fd.append('mov rsi,rax')
+
+            if self.optimize_size:
+                fd.append('call __sas_write')
+                self.context.use_helper('__sas_write')
+                return
+
+            fd.append('mov rax,0x01')
+            fd.append('mov rdi,0x01')
+            fd.append('syscall')
+            return
+
+        if len(buffers) == 1:
+            string_data_name, size = buffers[0]
+
+            if self.optimize_size:
+                fd.append(f'mov rsi,{string_data_name}')
+                fd.append(f'mov rdx,{size}')
+                fd.append('call __sas_write')
+                self.context.use_helper('__sas_write')
+                return
+
+            fd.append('mov rax,0x01')
+            fd.append('mov rdi,0x01')
+            fd.append(f'mov rsi,{string_data_name}')
+            fd.append(f'mov rdx,{size}')
+            fd.append('syscall')
+            return
+
+        # pieces that can't share a buffer are still written by a single writev
+        iovec_name = self.context.label('iov')
+        iovec = ', '.join('0, 0' if size is None else f'{name}, {size}' for name, size in buffers)
+
+        self.context.add_data(iovec_name, f'{iovec_name} dq {iovec}')
+
+        # every register gets its own digits and fills its entry of the iovec
+        for i, index in enumerate(integers):
+            self.emit_format(buffers[index][0], f'{digits}+{INTEGER_SIZE * (i + 1)}', fd)
+            fd.append(f'mov qword [rel {iovec_name}+{index * 16}],rax')
+            fd.append(f'mov qword [rel {iovec_name}+{index * 16 + 8}],rdx')
+
+        if self.optimize_size:
+            fd.append(f'mov rsi,{iovec_name}')
+            fd.append(f'mov rdx,{len(buffers)}')
+            fd.append('call __sas_writev')
+            self.context.use_helper('__sas_writev')
+            return
+
+        fd.append('mov rax,0x14')
+        fd.append('mov rdi,0x01')
+        fd.append(f'mov rsi,{iovec_name}')
+        fd.append(f'mov rdx,{len(buffers)}')
+        fd.append('syscall')
+
+    def worker_label(self, worker):
+        if worker.label is None:
+            worker.label = self.context.label('worker')
+
+        return worker.label
+
+    def emit_chunk(self, instruction, index, iovec, fd):
+        """runs a chunk of a parallel loop on the current thread and stores the
+        size of its output in the iovec"""
+        start, iterations, offset = instruction.chunks[index]
+        buffer = f'{iovec}_buffer' if offset == 0 else f'{iovec}_buffer+{offset}'
+
+        fd.append(f'mov rdi,{buffer}')
+        fd.append(f'mov {ARGUMENT_REGISTERS[0]},{start}')
+        fd.append(f'mov {ARGUMENT_REGISTERS[1]},{iterations}')
+        fd.append(f'call {self.worker_label(instruction.worker)}')
+        fd.append(f'mov rax,{buffer}')
+        fd.append('sub rdi,rax')
+        fd.append(f'mov qword [rel {iovec}+{index * 16 + 8}],rdi')
+
+    def emit_parallel(self, instruction, fd):
+        """starts a thread for every chunk but the first one, which runs on the
+        current thread, waits for all of them and writes their outputs in order"""
+        chunks = instruction.chunks
+        iovec = self.context.label('iov')
+        stacks = f'{iovec}_stacks'
+        tids = f'{iovec}_tids'
+        threads = [self.context.label('thread') for _ in chunks[1:]]
+
+        self.context.add_bss(f'{iovec}_buffer', f'{iovec}_buffer resb {max(1, instruction.buffer_size)}')
+        self.context.add_data(iovec, f'{iovec} dq ' + ', '.join(
+            f'{iovec}_buffer+{offset}, 0' for _, _, offset in chunks
+        ))
+
+        if len(threads) > 0:
+            self.context.add_bss(stacks, f'{stacks} resb {THREAD_STACK_SIZE * len(threads)}')
+            self.context.add_data(tids, f'{tids} dq {", ".join(["0"] * len(threads))}')
+
+        for thread, label in enumerate(threads):
+            spawned = self.context.label('bb')
+
+            # the kernel zeroes the tid and wakes its futex when the thread exits
+            fd.append(f'mov qword [rel {tids}+{thread * 8}],1')
+            fd.append('mov rax,0x38')
+            fd.append(f'mov rdi,{hex(CLONE_FLAGS)}')
+            fd.append(f'mov rsi,{stacks}+{THREAD_STACK_SIZE * (thread + 1)}')
+            fd.append('mov rdx,0')
+            fd.append(f'mov r10,{tids}+{thread * 8}')
+            fd.append('mov r8,0')
+            fd.append('syscall')
+            fd.append('cmp rax,0')
+            fd.append(f'je {label}')
+            fd.append(f'jg {spawned}')
+            # no thread, the chunk runs here instead
+            self.emit_chunk(instruction, thread + 1, iovec, fd)
+            fd.append(f'mov qword [rel {tids}+{thread * 8}],0')
+            fd.append(f'{spawned}:')
+
+        self.emit_chunk(instruction, 0, iovec, fd)
+
+        for thread in range(len(threads)):
+            join = self.context.label('join')
+
+            # futex(tid, FUTEX_WAIT, 1), returns right away once the tid is 0
+            fd.append(f'{join}:')
+            fd.append('mov rax,0xca')
+            fd.append(f'mov rdi,{tids}+{thread * 8}')
+            fd.append('mov rsi,0')
+            fd.append('mov rdx,1')
+            fd.append('mov r10,0')
+            fd.append('syscall')
+            fd.append(f'cmp qword [rel {tids}+{thread * 8}],0')
+            fd.append(f'jne {join}')
+
+        if self.optimize_size:
+            fd.append(f'mov rsi,{iovec}')
+            fd.append(f'mov rdx,{len(chunks)}')
+            fd.append('call __sas_writev')
+            self.context.use_helper('__sas_writev')
+        else:
+            fd.append('mov rax,0x14')
+            fd.append('mov rdi,0x01')
+            fd.append(f'mov rsi,{iovec}')
+            fd.append(f'mov rdx,{len(chunks)}')
+            fd.append('syscall')
+
+        if len(threads) == 0:
+            return
+
+        done = self.context.label('bb')
+        fd.append(f'jmp {done}')
+
+        for thread, label in enumerate(threads):
+            fd.append(f'{label}:')
+            self.emit_chunk(instruction, thread + 1, iovec, fd)
+            # exit only ends the calling thread
+            fd.append('mov rax,0x3c')
+            fd.append('mov rdi,0')
+            fd.append('syscall')
+
+        fd.append(f'{done}:')
+
+    def emit_instruction(self, function, instruction, fd):
+        if instruction.kind == IK_CONST:
+            value = self.operand(instruction.value, fd)
+            fd.append(f'mov {self.slot(instruction.register)},{value}')
+        elif instruction.kind == IK_ADD:
+            if instruction.value == 1:
+                fd.append(f'inc {self.slot(instruction.register)}')
+            elif instruction.value == -1:
+                fd.append(f'dec {self.slot(instruction.register)}')
+            else:
+                value = self.operand(instruction.value, fd)
+                fd.append(f'add {self.slot(instruction.register)},{value}')
+        elif instruction.kind == IK_WRITE:
+            self.emit_write(instruction.pieces, fd, function.worker)
+        elif instruction.kind == IK_CALL:
+            fd.append(f'call {instruction.label}')
+        elif instruction.kind == IK_COUNT:
+            offset = f'+{instruction.counter * 8}' if instruction.counter > 0 else ''
+            # workers share the counters with the other threads
+            lock = 'lock ' if function.worker else ''
+            fd.append(f'{lock}inc qword [rel {self.context.counters_label}{offset}]')
+        elif instruction.kind == IK_ARGUMENT:
+            fd.append(f'mov {self.slot(instruction.register)},{ARGUMENT_REGISTERS[instruction.index]}')
+        elif instruction.kind == IK_PARALLEL:
+            self.emit_parallel(instruction, fd)
+        else:
+            error(f'unhandled instruction kind {instruction.kind}')
+
+    def emit_frame_exit(self, function, fd):
+        if function.registers > 0:
+            fd.append(f'add rsp,{function.registers * 8}')
+
+    def emit_terminator(self, function, block, following, last, labels, fd):
+        """following is the block laid out right after this one, if any, and
+        last the block the function ends with"""
+        terminator = block.terminator
+
+        if terminator.kind == IK_JUMP:
+            if terminator.target is not following:
+                fd.append(f'jmp {labels[id(terminator.target)]}')
+        elif terminator.kind == IK_BRANCH:
+            value = self.operand(terminator.value, fd)
+            fd.append(f'cmp {self.slot(terminator.register)},{value}')
+
+            if terminator.then is following:
+                condition = INVERSE_CONDITIONS[terminator.condition]
+                fd.append(f'j{condition} {labels[id(terminator.otherwise)]}')
+            else:
+                fd.append(f'j{terminator.condition} {labels[id(terminator.then)]}')
+
+                if terminator.otherwise is not following:
+                    fd.append(f'jmp {labels[id(terminator.otherwise)]}')
+        elif terminator.kind == IK_RETURN:
+            self.emit_frame_exit(function, fd)
+            fd.append('ret')
+        elif terminator.kind == IK_EXIT:
+            self.context.emit_exit(terminator.code, fd)
+        elif terminator.kind == IK_END:
+            self.emit_frame_exit(function, fd)
+
+            if block is not last:
+                fd.append(f'jmp {labels["end"]}')
+        else:
+            error(f'unhandled terminator kind {terminator.kind}')
+
+    def jump_targets(self, function, following):
+        """the blocks some jump refers to, the others are only fallen into"""
+        targets = set()
+
+        for block in function.blocks:
+            terminator = block.terminator
+
+            if terminator.kind == IK_JUMP and terminator.target is not following[id(block)]:
+                targets.add(id(terminator.target))
+            elif terminator.kind == IK_BRANCH:
+                if terminator.then is following[id(block)]:
+                    targets.add(id(terminator.otherwise))
+                else:
+                    targets.add(id(terminator.then))
+
+                    if terminator.otherwise is not following[id(block)]:
+                        targets.add(id(terminator.otherwise))
+
+        return targets
+
+    def emit_function(self, function, fd, cold_fd):
+        """cold blocks go to cold_fd, which ends up after all the other code"""
+        entry = function.blocks[0]
+
+        if function.worker:
+            self.worker_label(function)
+
+        # a fn that never ran moves as a whole, the entry of a region always stays
+        if function.label is not None and entry.cold:
+            sequences = [(cold_fd, function.blocks)]
+        else:
+            sequences = [
+                (fd, [block for block in function.blocks if not block.cold]),
+                (cold_fd, [block for block in function.blocks if block.cold]),
+            ]
+
+        following = {}
+
+        for _, blocks in sequences:
+            for i, block in enumerate(blocks):
+                following[id(block)] = blocks[i + 1] if i + 1 < len(blocks) else None
+
+        targets = self.jump_targets(function, following)
+        labels = {}
+
+        for block in function.blocks:
+            if id(block) in targets:
+                labels[id(block)] = self.context.label(block.prefix)
+
+        # regions leave from their last block, the others jump there
+        last = sequences[0][1][-1]
+        if any(block.terminator.kind == IK_END and block is not last for block in function.blocks):
+            labels['end'] = self.context.label('end')
+
+        for out, blocks in sequences:
+            for block in blocks:
+                if block is entry:
+                    if function.label is not None:
+                        out.append(f'{function.label}:')
+
+                    if function.registers > 0:
+                        out.append(f'sub rsp,{function.registers * 8}')
+
+                if id(block) in labels:
+                    out.append(f'{labels[id(block)]}:')
+
+                for instruction in block.instructions:
+                    self.emit_instruction(function, instruction, out)
+
+                self.emit_terminator(function, block, following[id(block)], last, labels, out)
+
+        if 'end' in labels:
+            fd.append(f'{labels["end"]}:')
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+import os
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from utils import error, text_size
+
+# Measures how fast the executables the compiler produces run. Every workload
+# of the corpus is compiled once and run several times with its output going to
+# /dev/null, the resources every run used come from wait4, like getrusage.
+
+BENCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench')
+COMPILER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'compiler.py')
+RUNS = 10
+# slower than the baseline by more than this percentage is a regression
+THRESHOLD = 5.0
+# timings within this many seconds of the baseline are noise, whatever the
+# percentage. The kernel accounts user and sys time in scheduler ticks
+TIME_NOISE = 0.01
+# the measures compared with the baseline. Sizes are in bytes, times in seconds
+TIMES = ('wall', 'user', 'sys')
+SIZES = ('size', 'text')
+
+arg_index = 0
+
+
+def shift():
+    global arg_index
+    if arg_index >= len(sys.argv):
+        return None
+
+    arg_index += 1
+
+    return sys.argv[arg_index - 1]
+
+
+program_name = shift()
+
+flags = {}
+workloads = []
+
+while True:
+    flag = shift()
+
+    if flag is None:
+        break
+
+    match flag:
+        case "--runs":
+            value = shift()
+
+            if value is None or not value.isdigit() or int(value) < 1:
+                print('flag --runs expects a positive number')
+                exit(1)
+
+            flags['--runs'] = int(value)
+        case "--baseline" | "--save" | "--flags":
+            value = shift()
+
+            if value is None:
+                print(f'missing value for flag {flag}')
+                exit(1)
+
+            flags[flag] = value
+        case "--threshold":
+            value = shift()
+
+            try:
+                flags['--threshold'] = float(value)
+            except (TypeError, ValueError):
+                print('flag --threshold expects a percentage')
+                exit(1)
+        case "-h" | "--help":
+            print(f'usage: {program_name} [workload.sas...] [flags]')
+            print(f'  --runs <n>          runs of every workload, {RUNS} by default')
+            print('  --flags <flags>     compiler flags, like "-Os --threads 4"')
+            print('  --save <file>       write the results as a baseline')
+            print('  --baseline <file>   compare with a baseline and exit with 1 on regressions')
+            print(f'  --threshold <pct>   slowdown flagged as a regression, {THRESHOLD}% by default')
+            exit(0)
+        case _:
+            if flag.startswith('-'):
+                print(f'unrecognized flag "{flag}"')
+                exit(1)
+
+            workloads.append(flag)
+
+
+def get_flag(name):
+    if name in flags:
+        return flags[name]
+
+    return None
+
+
+def workload_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def compile_workload(path, directory):
+    binary = os.path.join(directory, workload_name(path))
+    command = [sys.executable, COMPILER, path, '-o', binary, *(get_flag('--flags') or '').split()]
+
+    # -Os reports the text size on stderr, only failures matter here
+    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+
+    if result.returncode != 0:
+        error(f'could not compile "{path}":\n{result.stderr}')
+
+    return binary
+
+
+def run_once(binary, devnull):
+    start = time.perf_counter()
+    process = subprocess.Popen([binary], stdout=devnull)
+    _, status, usage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - start
+
+    # wait4 already reaped it, don't let Popen try again
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    if process.returncode != 0:
+        error(f'"{binary}" exited with code {process.returncode}')
+
+    return {
+        'wall': wall,
+        'user': usage.ru_utime,
+        'sys': usage.ru_stime,
+        'voluntary switches': usage.ru_nvcsw,
+        'involuntary switches': usage.ru_nivcsw,
+    }
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+
+    if len(values) % 2 == 1:
+        return values[middle]
+
+    return (values[middle - 1] + values[middle]) / 2
+
+
+def measure(binary, runs):
+    """the median of every measure over runs, after a run warming up the caches"""
+    with open(os.devnull, 'wb') as devnull:
+        run_once(binary, devnull)
+        samples = [run_once(binary, devnull) for _ in range(runs)]
+
+    result = {name: median([sample[name] for sample in samples]) for name in samples[0]}
+    result['size'] = os.path.getsize(binary)
+    result['text'] = text_size(binary)
+
+    return result
+
+
+def regressions(name, result, baseline, threshold):
+    """the measures of result that got worse than baseline"""
+    found = []
+
+    for measure_name in TIMES:
+        before = baseline.get(measure_name)
+        after = result[measure_name]
+
+        if before is None or after - before <= TIME_NOISE:
+            continue
+
+        if after > before * (1 + threshold / 100):
+            found.append(f'{name}: {measure_name} {before:.4f}s -> {after:.4f}s{change(after, before)}')
+
+    for measure_name in SIZES:
+        before = baseline.get(measure_name)
+        after = result[measure_name]
+
+        if before is not None and after > before:
+            found.append(f'{name}: {measure_name} {before} -> {after} bytes{change(after, before)}')
+
+    return found
+
+
+def change(after, before):
+    if before is None or before == 0:
+        return ''
+
+    return f' {(after / before - 1) * 100:+.1f}%'
+
+
+def report(results, baseline):
+    columns = ('workload', 'wall', 'user', 'sys', 'switches', 'size', 'text')
+    rows = []
+
+    for name, result in results.items():
+        before = baseline.get(name, {})
+        switches = result['voluntary switches'] + result['involuntary switches']
+
+        rows.append((
+            name,
+            f'{result["wall"]:.4f}s{change(result["wall"], before.get("wall"))}',
+            f'{result["user"]:.4f}s{change(result["user"], before.get("user"))}',
+            f'{result["sys"]:.4f}s{change(result["sys"], before.get("sys"))}',
+            f'{switches:g}',
+            f'{result["size"]}{change(result["size"], before.get("size"))}',
+            f'{result["text"]}{change(result["text"], before.get("text"))}',
+        ))
+
+    widths = [max(len(row[i]) for row in rows + [columns]) for i in range(len(columns))]
+
+    for row in [columns] + rows:
+        print('  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip())
+
+
+def main():
+    paths = workloads or sorted(
+        os.path.join(BENCH_DIR, name) for name in os.listdir(BENCH_DIR) if name.endswith('.sas')
+    )
+    runs = get_flag('--runs') or RUNS
+    threshold = get_flag('--threshold')
+    threshold = THRESHOLD if threshold is None else threshold
+    baseline = {}
+
+    if get_flag('--baseline') is not None:
+        try:
+            with open(get_flag('--baseline'), 'r') as f:
+                baseline = json.load(f)
+        except (OSError, ValueError):
+            error(f'could not read baseline "{get_flag("--baseline")}"')
+
+    results = {}
+    directory = tempfile.mkdtemp(prefix='sas-bench-')
+
+    try:
+        for path in paths:
+            binary = compile_workload(path, directory)
+            results[workload_name(path)] = measure(binary, runs)
+    finally:
+        shutil.rmtree(directory)
+
+    report(results, baseline)
+
+    if get_flag('--save') is not None:
+        with open(get_flag('--save'), 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    found = []
+
+    for name, result in results.items():
+        if name in baseline:
+            found.extend(regressions(name, result, baseline[name], threshold))
+
+    if len(found) > 0:
+        print(f'\n{len(found)} regressions:')
+
+        for line in found:
+            print(f'  {line}')
+
+        exit(1)
+
+
+main()
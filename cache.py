@@ -0,0 +1,74 @@
+import os
+import json
+import hashlib
+
+DEFAULT_CACHE_DIR = '.sas-cache'
+
+
+def structure(value):
+    if isinstance(value, list):
+        return [structure(item) for item in value]
+
+    if hasattr(value, '__dict__'):
+        # moving an item around the file doesn't change the code generated for it
+        fields = sorted(
+            (name, field) for name, field in vars(value).items() if name != 'position'
+        )
+
+        return [type(value).__name__] + [[name, structure(field)] for name, field in fields]
+
+    return value
+
+
+def fingerprint(node):
+    serialized = json.dumps(structure(node), separators=(',', ':'))
+
+    return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
+
+def source_salt(paths):
+    digest = hashlib.sha1()
+
+    for path in paths:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+
+    return digest.hexdigest()
+
+
+class CodegenCache:
+    def __init__(self, directory, salt):
+        self.directory = directory
+        self.salt = salt
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, *parts):
+        serialized = json.dumps([self.salt, *parts], separators=(',', ':'), sort_keys=True)
+
+        return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, f'{key}.json')
+
+    def load(self, key):
+        try:
+            with open(self.path(key), 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+
+        return entry
+
+    def store(self, key, entry):
+        tmp_path = self.path(key) + '.tmp'
+
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f, separators=(',', ':'))
+
+        os.replace(tmp_path, self.path(key))
@@ -2,31 +2,41 @@
 import os
 import subprocess
 import hashlib
+import shutil
 import sys
-from nodes import (
-    N_FUNCTION_CALL,
-    N_IF_STATEMENT,
-    N_FOR_LOOP,
-    N_FN
-)
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from constants import (
-    K_STRING,
-    K_NUMBER,
-    K_LT,
-    K_GT,
-    K_EQ,
-    K_NOTEQ,
-    K_PLUS_PLUS,
-    K_MINUS_MINUS,
-
     NK_IF_STATEMENT,
-    NK_FOR_LOOP,
     NK_FUNCTION_CALL,
-    NK_FN
+    NK_FN,
+    NK_IMPORT,
+
+    BUILTIN_FUNCTIONS,
 )
-from utils import error, generate_random_string
+from utils import error, generate_random_string, text_size
 from lexer import Tokenizer
 from parser import Parser
+from optimizer import optimize
+from vm import Lowering, execute
+from lower import Lowerer
+from passes import PassManager, DEFAULT_PASSES
+from pgo import (
+    Profile,
+    ProfileGuidedPasses,
+    PROFILE_FILE,
+    PROGRAM,
+    module_tag,
+    read_profile,
+    format_profile,
+)
+from backend import Backend, RUNTIME_HELPERS, RUNTIME_LIBRARY
+import jit
+from jit import JitUnsupported
+from emitter import Section, SpilledSection, HashingSink, SPOOL_SIZE, COPY_SIZE
+from cache import CodegenCache, DEFAULT_CACHE_DIR, fingerprint, source_salt
+
+RUNTIME_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'runtime', 'runtime.asm')
 
 arg_index = 0
 
@@ -46,7 +56,17 @@ input_file = shift()
 
 if input_file is None:
     print(f'usage: {program_name} <filename> [flags]')
-    print('  -o         output filename')
+    print('  -o             output filename')
+    print('  -Os            share the code of every output and exit, and report the text size')
+    print('  --cache-dir    directory for the incremental codegen cache')
+    print('  --no-cache     regenerate every top-level item')
+    print('  --run          run the program in the bytecode VM, without nasm and ld')
+    print('  --jit          run the generated machine code in process, without nasm and ld')
+    print('  --dump-ir      print the IR of every function after the passes ran')
+    print('  --time-passes  print how long every IR pass took')
+    print(f'  --profile-generate      build a program writing its profile to {PROFILE_FILE}')
+    print('  --profile-use <profile>  optimize the hot paths of the profile')
+    print('  --threads <n>  threads running every parallel for, the number of CPUs by default')
     exit(1)
 
 flags = {}
@@ -74,10 +94,100 @@ while True:
                 exit(1)
 
             flags['-o'] = value
+        case "--cache-dir":
+            value = shift()
+
+            if value is None:
+                print('missing value for flag --cache-dir')
+                exit(1)
+
+            flags['--cache-dir'] = value
+        case "--no-cache":
+            flags['--no-cache'] = True
+        case "--run":
+            flags['--run'] = True
+        case "--jit":
+            flags['--jit'] = True
+        case "--dump-ir":
+            flags['--dump-ir'] = True
+        case "--time-passes":
+            flags['--time-passes'] = True
+        case "-Os":
+            flags['-Os'] = True
+        case "--profile-generate":
+            flags['--profile-generate'] = True
+        case "--profile-use":
+            value = shift()
+
+            if value is None:
+                print('missing value for flag --profile-use')
+                exit(1)
+
+            flags['--profile-use'] = value
+        case "--threads":
+            value = shift()
+
+            if value is None or not value.isdigit() or int(value) < 1:
+                print('flag --threads expects a positive number')
+                exit(1)
+
+            flags['--threads'] = int(value)
         case _:
             print(f'unrecognized flag "{flag}"')
 
 
+profile = None
+pass_list = DEFAULT_PASSES
+
+if get_flag('--profile-generate') is not None:
+    if get_flag('--profile-use') is not None:
+        print('--profile-generate and --profile-use can not be used together')
+        exit(1)
+
+    profile = Profile()
+elif get_flag('--profile-use') is not None:
+    profile = read_profile(get_flag('--profile-use'))
+    guided = ProfileGuidedPasses(profile)
+    pass_list = [
+        guided.inline_hot_calls,
+        *DEFAULT_PASSES,
+        guided.unroll_hot_loops,
+        guided.layout_blocks,
+    ]
+
+optimize_size = get_flag('-Os') is not None
+threads = get_flag('--threads') or os.cpu_count() or 1
+
+passes = PassManager(
+    pass_list,
+    dump=get_flag('--dump-ir') is not None,
+    timing=get_flag('--time-passes') is not None
+)
+
+
+def referenced_functions(node):
+    calls = set()
+    definitions = set()
+    pending = [node]
+
+    while len(pending) > 0:
+        node = pending.pop()
+
+        if node.kind == NK_FUNCTION_CALL:
+            if node.name not in BUILTIN_FUNCTIONS:
+                calls.add(node.name)
+        elif node.kind == NK_FN:
+            definitions.add(node.name)
+
+        if node.kind != NK_FUNCTION_CALL:
+            pending.extend(node.body)
+
+        if node.kind == NK_IF_STATEMENT:
+            pending.extend(node.elze_block)
+
+    return calls, definitions
+
+
 def get_program_without_extension():
     name = input_file.strip()
 
@@ -87,258 +197,630 @@ def get_program_without_extension():
     return name
 
 
+def text_data(name, text):
+    parts = []
+    for i, segment in enumerate(text.split('\n')):
+        if i > 0:
+            parts.append('0x0A')
+        if len(segment) > 0:
+            parts.append(f'"{segment}"')
+
+    return f'{name} db {", ".join(parts)}'
+
+
+def profile_symbol(prefix, module):
+    if module is None:
+        return prefix
+
+    return f'{prefix}_{module}'
+
+
 class Compiler:
-    def __init__(self, nodes):
-        self.code = [
-            'global _start',
-            'section .text',
-            '_start:',
-        ]
-        self.fn_declarations = []
-        self.data = [
-            'section .data'
-        ]
+    def __init__(
+        self,
+        nodes,
+        out,
+        cache=None,
+        module=None,
+        imports={},
+        passes=None,
+        profile=None,
+        optimize_size=False,
+        helpers=None,
+        threads=1
+    ):
+        # the main code is streamed to out as it's generated, the sections
+        # written after it are spilled until the end
+        self.out = out
+        self.code = Section(out)
+        self.fn_declarations = SpilledSection()
+        self.cold_code = SpilledSection()
+        self.cold_code.append(';; cold code')
+        self.data = SpilledSection()
+        self.data.append('section .data')
+        # uninitialized, only takes space once the program runs
+        self.bss = []
         self.nodes = nodes
-        self.data_references = {}
-        self.var_to_reg = {}
-        self.fn_to_label = {}
+        self.cache = cache
+        # None for the program entry point, the import name for every other module
+        self.module = module
+        self.profile = profile
+        self.instrumented = profile is not None and profile.instrument
+        self.counters_label = profile_symbol('__sas_counters', module)
+        self.lowerer = Lowerer(module, imports, profile, threads)
+        self.threads = threads
+        self.passes = passes or PassManager()
+        self.optimize_size = optimize_size
+        # the runtime helpers called by every module, the entry point emits them
+        self.helpers = helpers if helpers is not None else set()
+        self.item_helpers = None
+        self.backend = Backend(self, optimize_size)
+        self.imports = imports
+        self.exports = {}
+        # names of the data lines already written, the lines live in self.data
+        self.data_references = set()
+        self.namespaces = {}
+        self.namespace = None
+        self.label_count = 0
+        self.item_data = None
+        self.item_bss = None
+
+    def label(self, prefix):
+        label = f'{prefix}_{self.namespace}_{self.label_count}'
+
+        self.label_count += 1
+
+        return label
+
+    def get_text_reference(self, text):
+        string_data_name = '_' + hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+
+        # every item keeps the strings it uses, so a cached item never depends on
+        # another item having emitted them first
+        self.item_data[string_data_name] = text_data(string_data_name, text)
 
-    def get_string_reference(self, string, linebreak):
-        string_hash = string
-        if linebreak:
-            string_hash = string_hash + '<br/>'
+        return string_data_name
 
-        hash = '_' + hashlib.sha1(string_hash.encode('utf-8')).hexdigest()[:12]
+    def add_data(self, name, line):
+        self.item_data[name] = line
 
-        if hash in self.data_references:
-            return self.data_references[hash]
+    def add_bss(self, name, line):
+        self.item_bss[name] = line
 
-        string_data_name = hash.replace('-', '')
+    def use_helper(self, name):
+        self.item_helpers.add(name)
 
-        if linebreak:
-            self.data.append(f'{string_data_name} db "{string}", 0x0A')
-        else:
-            self.data.append(f'{string_data_name} db "{string}"')
+    def emit_exit(self, code, fd):
+        if self.optimize_size:
+            fd.append(f'mov rdi,{code}')
+            fd.append('call __sas_exit')
+            self.helpers.add('__sas_exit')
 
-        self.data_references[hash] = string_data_name
+            if self.item_helpers is not None:
+                self.item_helpers.add('__sas_exit')
+            return
 
-        return string_data_name
+        if self.instrumented:
+            fd.append('call __sas_profile_dump')
 
-    def compile_function_call(self, fn: N_FUNCTION_CALL, scope, fd):
-        # builtin functions
-        if fn.name == 'println':
-            if len(fn.arguments) != 1:
-                error(f'print expects only one argument but got {len(fn.arguments)}')
-            if fn.arguments[0].kind != K_STRING:
-                error(f'print expects one argument as string but got {fn.arguments[0].kind}')
-
-            string_data_name = self.get_string_reference(
-                fn.arguments[0].value,
-                True
-            )
+        fd.append('mov rax,0x3c')
+        fd.append(f'mov rdi,{code}')
+        fd.append('syscall')
+
+    def exit(self):
+        self.emit_exit('0x00', self.code)
+
+    def emit_runtime_helpers(self):
+        """the helpers are emitted once, by the entry point, for every module"""
+        for name, lines in RUNTIME_HELPERS.items():
+            if name not in self.helpers:
+                continue
+
+            self.code.append(f'global {name}')
+            self.fn_declarations.append(f'{name}:')
+
+            if name == '__sas_exit' and self.instrumented:
+                self.fn_declarations.append('call __sas_profile_dump')
+
+            self.fn_declarations.extend(lines)
+
+    def emit_profile(self):
+        """the counters of the module with the names the profile gives them. The
+        entry point also gets __sas_profile_dump, writing the counters of every
+        module to PROFILE_FILE"""
+        counters = self.profile.counters.get(module_tag(self.module), [])
+        names_label = profile_symbol('__sas_profile', self.module)
+
+        if len(counters) > 0:
+            self.data.append(text_data(names_label, self.profile.header(self.module)))
+            self.data.append(f'{self.counters_label} dq {", ".join(["0"] * len(counters))}')
+
+            if self.module is not None:
+                self.code.append(f'global {names_label}')
+                self.code.append(f'global {self.counters_label}')
+
+        if self.module is not None:
+            return
+
+        # modules exiting from their functions call it too
+        self.code.append('global __sas_profile_dump')
+
+        iovec = []
+
+        for tag, names in self.profile.counters.items():
+            module = None if tag == PROGRAM else tag
+            header = self.profile.header(module)
 
-            fd.append('mov rax,0x01')
-            fd.append('mov rdi,0x01')
-            fd.append(f'mov rsi,{string_data_name}')
-            fd.append(f'mov rdx,{len(fn.arguments[0].value) + 1}')
+            iovec.append(f'{profile_symbol("__sas_profile", module)}, {len(header.encode("utf-8"))}')
+            iovec.append(f'{profile_symbol("__sas_counters", module)}, {len(names) * 8}')
+
+        path = text_data('__sas_profile_path', PROFILE_FILE)
+
+        self.data.append(f'{path}, 0x00')
+
+        fd = self.fn_declarations
+        fd.append('__sas_profile_dump:')
+        # open(PROFILE_FILE, O_WRONLY | O_CREAT | O_TRUNC, 0644)
+        fd.append('mov rax,0x02')
+        fd.append('mov rdi,__sas_profile_path')
+        fd.append('mov rsi,0x241')
+        fd.append('mov rdx,0x1a4')
+        fd.append('syscall')
+
+        if len(iovec) > 0:
+            self.data.append(f'__sas_profile_iov dq {", ".join(iovec)}')
+
+            fd.append('mov rdi,rax')
+            fd.append('mov rax,0x14')
+            fd.append('mov rsi,__sas_profile_iov')
+            fd.append(f'mov rdx,{len(iovec)}')
             fd.append('syscall')
-        elif fn.name == 'print':
-            if len(fn.arguments) != 1:
-                error(f'print expects only one argument but got {len(fn.arguments)}')
-            if fn.arguments[0].kind != K_STRING:
-                error(f'print expects one argument as string but got {fn.arguments[0].kind}')
-
-            string_data_name = self.get_string_reference(
-                fn.arguments[0].value,
-                False
+
+        fd.append('mov rax,0x03')
+        fd.append('syscall')
+        fd.append('ret')
+
+    def item_key(self, node, node_fingerprint):
+        calls, definitions = referenced_functions(node)
+
+        # the generated code only depends on the labels of the functions the item
+        # calls and on how many times the functions it defines were defined before
+        signatures = {
+            name: [self.lowerer.fn_to_label.get(name), self.lowerer.fn_definitions.get(name, 0)]
+            for name in calls | definitions
+        }
+
+        return self.cache.key(
+            node_fingerprint,
+            self.module,
+            self.namespace,
+            signatures,
+            self.optimize_size,
+            self.threads
+        )
+
+    def generate_item(self, node):
+        code = []
+        fn_declarations = []
+        cold_code = []
+        self.item_data = {}
+        self.item_bss = {}
+        self.item_helpers = set()
+        definitions_before = dict(self.lowerer.fn_definitions)
+        fn_definitions = self.lowerer.fn_definitions
+
+        # lower to IR, optimize it and only then pick the instructions
+        for function in self.lowerer.lower_item(node):
+            self.passes.run(function)
+            self.backend.emit_function(
+                function,
+                code if function.label is None and not function.worker else fn_declarations,
+                cold_code
             )
 
-            fd.append('mov rax,0x01')
-            fd.append('mov rdi,0x01')
-            fd.append(f'mov rsi,{string_data_name}')
-            fd.append(f'mov rdx,{len(fn.arguments[0].value)}')
-            fd.append('syscall')
-        elif fn.name == 'exit':
-            if len(fn.arguments) != 1:
-                error(f'exit expects only one argument but got {len(fn.arguments)}')
-            if fn.arguments[0].kind != K_NUMBER:
-                error(f'exit expects one argument as number but got {fn.arguments[0].kind}')
-
-            fd.append('mov rax,0x3c')
-            fd.append(f'mov rdi,{fn.arguments[0].value}')
-            fd.append('syscall')
+        return {
+            'code': code,
+            'fn_declarations': fn_declarations,
+            'cold_code': cold_code,
+            'data': self.item_data,
+            'bss': self.item_bss,
+            'helpers': sorted(self.item_helpers),
+            'functions': {
+                name: self.lowerer.fn_to_label[name]
+                for name, count in fn_definitions.items()
+                if definitions_before.get(name) != count
+            },
+            'definitions': {
+                name: count - definitions_before.get(name, 0)
+                for name, count in fn_definitions.items()
+                if definitions_before.get(name) != count
+            },
+        }
+
+    def compile_item(self, node):
+        if node.kind == NK_IMPORT:
+            self.lowerer.lower_import(node)
+            return
+
+        if self.module is not None and node.kind != NK_FN:
+            error(f'module "{self.module}" can only contain functions and imports')
+
+        node_fingerprint = fingerprint(node)
+        occurrence = self.namespaces.get(node_fingerprint, 0)
+
+        self.namespaces[node_fingerprint] = occurrence + 1
+        self.namespace = node_fingerprint[:12]
+        self.label_count = 0
+
+        if occurrence > 0:
+            self.namespace += f'_{occurrence}'
+
+        entry = None
+        key = None
+
+        if self.cache is not None:
+            key = self.item_key(node, node_fingerprint)
+            entry = self.cache.load(key)
+
+        if entry is None:
+            entry = self.generate_item(node)
+
+            if key is not None:
+                self.cache.store(key, entry)
         else:
-            if fn.name in self.fn_to_label:
-                fn_label = self.fn_to_label[fn.name]
+            self.lowerer.fn_to_label.update(entry['functions'])
+
+            for name, count in entry['definitions'].items():
+                fn_definitions = self.lowerer.fn_definitions
+                fn_definitions[name] = fn_definitions.get(name, 0) + count
 
-                fd.append(f'call {fn_label}')
+        self.exports.update(entry['functions'])
+        self.code.extend(entry['code'])
+        self.fn_declarations.extend(entry['fn_declarations'])
+        self.cold_code.extend(entry['cold_code'])
+        self.helpers.update(entry['helpers'])
+
+        for name, line in entry['data'].items():
+            if name not in self.data_references:
+                self.data_references.add(name)
+                self.data.append(line)
+
+        self.bss.extend(entry['bss'].values())
+
+    def compile(self):
+        for exports in self.imports.values():
+            for label in exports.values():
+                self.code.append(f'extern {label}')
+
+        for name in RUNTIME_LIBRARY:
+            self.code.append(f'extern {name}')
+
+        if self.instrumented:
+            # the entry point is compiled last, every other module is already known
+            if self.module is None:
+                for tag in self.profile.counters:
+                    if tag == PROGRAM:
+                        continue
+
+                    self.code.append(f'extern {profile_symbol("__sas_profile", tag)}')
+                    self.code.append(f'extern {profile_symbol("__sas_counters", tag)}')
             else:
-                error(f'function "{fn.name}" does not exists')
-
-    def compile_for_loop(self, loop: N_FOR_LOOP, scope, fd):
-        loop_label = generate_random_string('for', 10)
-
-        if loop_label not in self.var_to_reg:
-            self.var_to_reg[loop_label] = {}
-
-        reg = 'rbx'
-
-        if loop.var_name is not None:
-            self.var_to_reg[loop_label][loop.var_name] = reg
-
-        fd.append(f'push {loop.start}')
-        fd.append(f'{loop_label}:')
-        fd.append(f'pop {reg}')
-        fd.append(f'push {reg}')
-        for node in loop.body:
-            self.compile_node(node, loop_label, fd)
-        fd.append('pop rbx')
-        if loop.update == K_PLUS_PLUS:
-            fd.append('inc rbx')
-        elif loop.update == K_MINUS_MINUS:
-            fd.append('dec rbx')
-        fd.append('push rbx')
-        fd.append(f'cmp rbx,{loop.end}')
-        if loop.condition == K_EQ:
-            fd.append(f'je {loop_label}')
-        elif loop.condition == K_NOTEQ:
-            fd.append(f'jne {loop_label}')
-        elif loop.condition == K_LT:
-            fd.append(f'jl {loop_label}')
-        elif loop.condition == K_GT:
-            fd.append(f'jg {loop_label}')
-        else:
-            error(f'invalid condition {loop.condition}')
-        fd.append('pop rbx')
+                self.code.append('extern __sas_profile_dump')
 
-    def compile_if(self, node: N_IF_STATEMENT, scope, fd):
-        if node.var_name not in self.var_to_reg[scope]:
-            error(f'variable "{node.var_name}" not found')
+        if self.module is None:
+            self.code.append('global _start')
 
-        reg = self.var_to_reg[scope][node.var_name]
+        self.code.append('section .text')
 
-        end_if_label = generate_random_string('endif', 10)
+        if self.module is None:
+            self.code.append('_start:')
 
-        fd.append(f'cmp {reg},{node.value}')
-        if node.operator == K_LT:
-            fd.append(f'jge {end_if_label}')
-        elif node.operator == K_GT:
-            fd.append(f'jle {end_if_label}')
-        for child in node.body:
-            self.compile_node(child, scope, fd)
+        for node in self.nodes:
+            self.compile_item(node)
+
+        if self.instrumented:
+            self.emit_profile()
 
-        if len(node.elze_block) > 0:
-            end_else_label = generate_random_string('else', 10)
+        if self.module is None:
+            self.exit()
 
-            fd.append(f'jmp {end_else_label}')
-            fd.append(f'{end_if_label}:')
-            for child in node.elze_block:
-                self.compile_node(child, scope, fd)
-            fd.append(f'{end_else_label}:')
+            if self.optimize_size:
+                self.emit_runtime_helpers()
         else:
-            fd.append(f'{end_if_label}:')
+            for label in self.exports.values():
+                self.code.append(f'global {label}')
 
-    def compile_fn(self, node: N_FN, scope, fd):
-        fn_label = generate_random_string('fn', 10)
+            for name in sorted(self.helpers):
+                self.code.append(f'extern {name}')
 
-        # FIXME: it's not guaranteed we don't have colliding labels
+        self.code.append(';; function declarations')
+        self.code.flush()
+        self.fn_declarations.copy_to(self.out)
+        self.cold_code.copy_to(self.out)
 
-        if fn_label not in self.var_to_reg:
-            self.var_to_reg[fn_label] = {}
+        if len(self.bss) > 0:
+            self.data.append('section .bss')
+            self.data.extend(self.bss)
 
-        self.fn_to_label[node.name] = fn_label
+        self.data.copy_to(self.out)
 
-        if scope == 'root':
-            self.fn_declarations.append(f'{fn_label}:')
-        else:
-            fd.append(f'{fn_label}:')
-        for node in node.body:
-            if scope == 'root':
-                self.compile_node(node, fn_label, self.fn_declarations)
-            else:
-                self.compile_node(node, fn_label, fd)
-        if scope == 'root':
-            self.fn_declarations.append('ret')
-        else:
-            fd.append('ret')
 
-    def exit(self):
-        self.code.append('mov rax,0x3c')
-        self.code.append('mov rdi,0x00')
-        self.code.append('syscall')
+def parse_file(path):
+    try:
+        content = open(path, 'r').read()
+    except OSError:
+        error(f'could not read "{path}"')
 
-    def compile_node(self, node, scope, fd):
-        if node.kind == NK_FUNCTION_CALL:
-            self.compile_function_call(node, scope, fd)
-        elif node.kind == NK_FOR_LOOP:
-            self.compile_for_loop(node, scope, fd)
-        elif node.kind == NK_IF_STATEMENT:
-            self.compile_if(node, scope, fd)
-        elif node.kind == NK_FN:
-            self.compile_fn(node, scope, fd)
-        else:
-            error(f'unhandled node kind {node.kind}')
+    tokenizer = Tokenizer(content)
 
-    def compile(self):
-        for node in self.nodes:
-            self.compile_node(node, 'root', self.code)
-
-        self.exit()
-
-        tmp_file_name = generate_random_string('comp', 12)
-        tmp_file_path = f'/tmp/{tmp_file_name}'
-        tmp_out_file_path = f'/tmp/{tmp_file_name}.o'
-        compiled_name = get_flag('-o') or get_program_without_extension()
-
-        with open(tmp_file_path, 'w') as f:
-            for line in self.code:
-                f.write(line)
-                f.write('\n')
-            f.write(';; function declarations\n')
-            for line in self.fn_declarations:
-                f.write(line)
-                f.write('\n')
-            for line in self.data:
-                f.write(line)
-                f.write('\n')
-            f.close()
-
-        compile_code = subprocess.call([
-            'nasm',
-            '-g',
-            '-felf64',
-            f'{tmp_file_path}',
-            '-o',
-            f'{tmp_out_file_path}'
-        ])
+    tokens = tokenizer.tokenize()
 
-        if compile_code != 0:
-            error(f'compilation failed with return code {compile_code}')
+    parser = Parser(tokens)
 
-        link_code = subprocess.call([
-            'ld',
-            f'{tmp_out_file_path}',
-            '-o',
-            f'./{compiled_name}'
-        ])
+    return optimize(parser.parse())
+
+
+def resolve_modules(path):
+    """returns (module name, nodes, imported names) in dependency order"""
+    modules = []
+    paths = {}
+    visiting = set()
+
+    def visit(name, path):
+        path = os.path.abspath(path)
+
+        if name in paths:
+            if paths[name] != path:
+                error(f'module "{name}" refers to both "{paths[name]}" and "{path}"')
+            if name in visiting:
+                error(f'circular import of module "{name}"')
+            return
+
+        paths[name] = path
+        visiting.add(name)
+
+        nodes = parse_file(path)
+        imported = [node.name for node in nodes if node.kind == NK_IMPORT]
+
+        for module_name in imported:
+            visit(module_name, os.path.join(os.path.dirname(path), f'{module_name}.sas'))
+
+        visiting.remove(name)
+        modules.append((name, nodes, imported))
+
+    visit(None, path)
+
+    return modules
+
+
+def assemble(asm_path, object_path):
+    return subprocess.call([
+        'nasm',
+        '-g',
+        '-felf64',
+        f'{asm_path}',
+        '-o',
+        f'{object_path}'
+    ])
+
+
+def generate(cache, open_sink, optimize_size=False, pass_manager=None):
+    """writes the assembly of every module, the entry point last, to the
+    sinks returned by open_sink and returns them"""
+    pass_manager = pass_manager or passes
+    exports = {}
+    sinks = []
+    helpers = set()
+
+    for name, nodes, imported in resolve_modules(input_file):
+        sink = open_sink()
+        compiler = Compiler(
+            nodes,
+            sink,
+            cache,
+            name,
+            {module_name: exports[module_name] for module_name in imported},
+            pass_manager,
+            profile,
+            optimize_size,
+            helpers,
+            threads
+        )
+
+        compiler.compile()
+        sinks.append(sink)
+        exports[name] = compiler.exports
+
+    pass_manager.report()
+
+    return sinks
+
+
+def report_text_size(objects, default_objects):
+    """compares the size of the machine code with and without -Os"""
+    size = sum(text_size(path) for path in objects)
+    default_size = sum(text_size(path) for path in default_objects)
+    delta = size - default_size
+    percent = delta * 100 / default_size if default_size > 0 else 0
+
+    sys.stderr.write(
+        f'text size: {size} bytes with -Os, {default_size} bytes without '
+        f'({delta:+} bytes, {percent:+.1f}%)\n'
+    )
+
+
+def module_objects(cache, size_optimized, pending, tmp_files, pass_manager=None):
+    """generates every module and returns the paths of their objects. The ones
+    that still have to be assembled are added to pending"""
+    objects = []
+    sources = []
+
+    def open_sink():
+        tmp_file_path = f'/tmp/{generate_random_string("comp", 12)}'
+        sources.append(tmp_file_path)
+
+        return HashingSink(open(tmp_file_path, 'w', buffering=COPY_SIZE))
+
+    sinks = generate(cache, open_sink, size_optimized, pass_manager)
+    tmp_files.extend(sources)
+
+    for tmp_file_path, sink in zip(sources, sinks):
+        sink.out.close()
 
-        if link_code != 0:
-            error(f'linking failed with return code {link_code}')
+        tmp_out_file_path = f'{tmp_file_path}.o'
+        object_path = tmp_out_file_path
+        tmp_files.append(tmp_out_file_path)
 
-        os.remove(tmp_file_path)
-        os.remove(tmp_out_file_path)
+        # unchanged modules produce the same assembly, so their object is reused
+        if cache is not None:
+            object_path = os.path.join(cache.directory, f'{sink.hexdigest()}.o')
 
+            if os.path.exists(object_path) or object_path in [job[2] for job in pending]:
+                objects.append(object_path)
+                continue
 
-content = open(input_file, 'r').read()
+        objects.append(object_path)
+        pending.append((tmp_file_path, tmp_out_file_path, object_path))
 
-tokenizer = Tokenizer(content)
+    return objects
 
-tokens = tokenizer.tokenize()
 
-parser = Parser(tokens)
+def build(cache, compiled_name):
+    pending = []
+    tmp_files = []
+    objects = module_objects(cache, optimize_size, pending, tmp_files)
+    default_objects = None
 
-nodes = parser.parse()
+    # -Os is compared with the same program built without it, assembled with the
+    # same jobs and never linked
+    if optimize_size:
+        default_objects = module_objects(cache, False, pending, tmp_files, PassManager(pass_list))
+
+    # the runtime library only changes with the compiler, so it's assembled once
+    runtime_path = f'/tmp/{generate_random_string("runtime", 12)}.o'
+    runtime_object = runtime_path
+    tmp_files.append(runtime_path)
+
+    if cache is not None:
+        with open(RUNTIME_SOURCE, 'rb') as f:
+            runtime_object = os.path.join(cache.directory, f'runtime_{hashlib.sha1(f.read()).hexdigest()}.o')
+
+    objects.append(runtime_object)
+
+    if not os.path.exists(runtime_object):
+        pending.append((RUNTIME_SOURCE, runtime_path, runtime_object))
+
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        codes = list(executor.map(lambda job: assemble(job[0], job[1]), pending))
+
+    for code in codes:
+        if code != 0:
+            error(f'compilation failed with return code {code}')
+
+    # objects only enter the cache once nasm finished writing them
+    for _, tmp_out_file_path, object_path in pending:
+        if object_path != tmp_out_file_path:
+            shutil.move(tmp_out_file_path, object_path)
+
+    if default_objects is not None:
+        report_text_size(objects, default_objects + [runtime_object])
+
+    link_code = subprocess.call([
+        'ld',
+        *objects,
+        '-o',
+        os.path.join('.', compiled_name)
+    ])
+
+    if link_code != 0:
+        error(f'linking failed with return code {link_code}')
+
+    for path in tmp_files:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def run():
+    lowering = Lowering(passes, profile, threads)
+    bytecode, texts = lowering.lower(resolve_modules(input_file))
+
+    passes.report()
+
+    if profile is not None and profile.instrument:
+        counters = lowering.counters()
+
+        def write_profile():
+            values = dict(zip(profile.counters, counters))
+
+            with open(PROFILE_FILE, 'wb') as f:
+                f.write(format_profile(profile, values))
+
+        exit(execute(bytecode, texts, counters=counters, at_exit=write_profile))
+
+    exit(execute(bytecode, texts))
+
+
+def run_jit(cache):
+    try:
+        sinks = generate(
+            cache,
+            lambda: tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE, mode='w+'),
+            optimize_size
+        )
+
+        for sink in sinks:
+            sink.seek(0)
+
+        code, output = jit.run(sinks)
+    except JitUnsupported:
+        # build a regular executable and run it instead
+        compiled_name = f'/tmp/{generate_random_string("jit", 12)}'
+
+        build(cache, compiled_name)
+
+        code = subprocess.call([compiled_name])
+        os.remove(compiled_name)
+
+        exit(code)
+
+    sys.stdout.buffer.write(output)
+    sys.stdout.flush()
+
+    exit(code)
+
+
+if get_flag('--run') is not None:
+    run()
+
+cache = None
+
+# cached items skip the passes, so there would be nothing to dump or time. The
+# profile decides what gets inlined, so items don't only depend on themselves
+if get_flag('--no-cache') is None and not passes.dump and not passes.timing and profile is None:
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+
+    # every module shaping the generated assembly, a change in any of them
+    # invalidates the cached items
+    cache = CodegenCache(
+        get_flag('--cache-dir') or DEFAULT_CACHE_DIR,
+        source_salt([
+            os.path.join(source_dir, name)
+            for name in (
+                'compiler.py',
+                'constants.py',
+                'nodes.py',
+                'optimizer.py',
+                'lower.py',
+                'ir.py',
+                'passes.py',
+                'backend.py',
+                'emitter.py',
+                'cache.py',
+            )
+        ])
+    )
 
-compiler = Compiler(nodes)
+if get_flag('--jit') is not None:
+    run_jit(cache)
 
-compiler.compile()
+build(cache, get_flag('-o') or get_program_without_extension())
@@ -7,25 +7,90 @@ CHARS = set(
     CHARS_ARRAY
 )
 NUMBERS = '0123456789'
-K_EOF = 'eof'
-K_SYMBOL = 'sym'
-K_LEFT_PAREN = 'lparen'
-K_RIGHT_PAREN = 'rparen'
-K_LEFT_BRACKET = 'lbracket'
-K_RIGHT_BRACKET = 'rbracket'
-K_STRING = 'str'
-K_NUMBER = 'int'
-K_SEMI_COLON = 'semicol'
-K_EQUAL = 'equal'
-K_LT = 'lt'
-K_GT = 'gt'
-K_EQ = 'eq'
-K_NOTEQ = 'neq'
-K_PLUS = 'plus'
-K_PLUS_PLUS = 'plusplus'
-K_MINUS_MINUS = 'minusminus'
+K_EOF = 0
+K_SYMBOL = 1
+K_LEFT_PAREN = 2
+K_RIGHT_PAREN = 3
+K_LEFT_BRACKET = 4
+K_RIGHT_BRACKET = 5
+K_STRING = 6
+K_NUMBER = 7
+K_SEMI_COLON = 8
+K_EQUAL = 9
+K_LT = 10
+K_GT = 11
+K_EQ = 12
+K_NOTEQ = 13
+K_PLUS = 14
+K_PLUS_PLUS = 15
+K_MINUS_MINUS = 16
+K_FOR = 17
+K_IF = 18
+K_ELSE = 19
+K_FN = 20
+K_AS = 21
+K_IMPORT = 22
+K_PARALLEL = 23
+
+# used by error messages only
+KIND_NAMES = (
+    'eof',
+    'sym',
+    'lparen',
+    'rparen',
+    'lbracket',
+    'rbracket',
+    'str',
+    'int',
+    'semicol',
+    'equal',
+    'lt',
+    'gt',
+    'eq',
+    'neq',
+    'plus',
+    'plusplus',
+    'minusminus',
+    'for',
+    'if',
+    'else',
+    'fn',
+    'as',
+    'import',
+    'parallel',
+)
+
+KEYWORDS = {
+    'for': K_FOR,
+    'if': K_IF,
+    'else': K_ELSE,
+    'fn': K_FN,
+    'as': K_AS,
+    'import': K_IMPORT,
+    'parallel': K_PARALLEL,
+}
 
 NK_FUNCTION_CALL = 'funcall'
 NK_FOR_LOOP = 'for_loop'
 NK_IF_STATEMENT = 'if'
 NK_FN = 'fn'
+NK_IMPORT = 'import'
+NK_WRITE = 'write'
+
+BUILTIN_FUNCTIONS = {'print', 'println', 'exit'}
+
+# the most chars of a printed 64 bit integer, sign included
+INTEGER_SIZE = 20
+
+IK_CONST = 'const'
+IK_ADD = 'add'
+IK_WRITE = 'write'
+IK_CALL = 'call'
+IK_JUMP = 'jump'
+IK_BRANCH = 'branch'
+IK_RETURN = 'return'
+IK_EXIT = 'exit'
+IK_END = 'end'
+IK_COUNT = 'count'
+IK_ARGUMENT = 'argument'
+IK_PARALLEL = 'parallel'
@@ -0,0 +1,58 @@
+import hashlib
+import shutil
+import tempfile
+
+# lines are joined and written in chunks of this many lines
+CHUNK_LINES = 4096
+# sections bigger than this are spilled to a temporary file
+SPOOL_SIZE = 1024 * 1024
+COPY_SIZE = 1024 * 1024
+
+
+class Section:
+    """append-only list of assembly lines written straight to out in large chunks"""
+    def __init__(self, out):
+        self.out = out
+        self.pending = []
+
+    def append(self, line):
+        self.pending.append(line)
+
+        if len(self.pending) >= CHUNK_LINES:
+            self.flush()
+
+    def extend(self, lines):
+        for line in lines:
+            self.append(line)
+
+    def flush(self):
+        if len(self.pending) > 0:
+            self.out.write('\n'.join(self.pending) + '\n')
+            self.pending.clear()
+
+
+class SpilledSection(Section):
+    """a section that can only be written after the ones before it, kept in a
+    buffer that moves to disk once it outgrows SPOOL_SIZE"""
+    def __init__(self):
+        super().__init__(tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE, mode='w+'))
+
+    def copy_to(self, out):
+        self.flush()
+        self.out.seek(0)
+        shutil.copyfileobj(self.out, out, COPY_SIZE)
+        self.out.close()
+
+
+class HashingSink:
+    """file wrapper hashing everything written through it"""
+    def __init__(self, out):
+        self.out = out
+        self.hash = hashlib.sha1()
+
+    def write(self, text):
+        self.hash.update(text.encode('utf-8'))
+        self.out.write(text)
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
@@ -0,0 +1,256 @@
+from constants import (
+    K_LT,
+    K_GT,
+    K_EQ,
+    K_NOTEQ,
+
+    IK_CONST,
+    IK_ADD,
+    IK_WRITE,
+    IK_CALL,
+    IK_JUMP,
+    IK_BRANCH,
+    IK_RETURN,
+    IK_EXIT,
+    IK_END,
+    IK_COUNT,
+    IK_ARGUMENT,
+    IK_PARALLEL,
+)
+
+# Mid-level representation between the AST and the assembly: functions made of
+# basic blocks, each one a list of instructions closed by a single terminator.
+# Values live in numbered virtual registers.
+
+# branch conditions, named after the x86 condition codes
+CONDITIONS = {
+    K_LT: 'l',
+    K_GT: 'g',
+    K_EQ: 'e',
+    K_NOTEQ: 'ne',
+}
+
+INVERSE_CONDITIONS = {
+    'l': 'ge',
+    'ge': 'l',
+    'g': 'le',
+    'le': 'g',
+    'e': 'ne',
+    'ne': 'e',
+}
+
+CONDITION_SYMBOLS = {
+    'l': '<',
+    'g': '>',
+    'le': '<=',
+    'ge': '>=',
+    'e': '==',
+    'ne': '!=',
+}
+
+
+def evaluate(condition, left, right):
+    if condition == 'l':
+        return left < right
+    if condition == 'g':
+        return left > right
+    if condition == 'le':
+        return left <= right
+    if condition == 'ge':
+        return left >= right
+    if condition == 'e':
+        return left == right
+
+    return left != right
+
+
+class I_CONST:
+    def __init__(self, register, value):
+        self.kind = IK_CONST
+        self.register = register
+        self.value = value
+
+
+class I_ADD:
+    def __init__(self, register, value):
+        self.kind = IK_ADD
+        self.register = register
+        self.value = value
+
+
+class I_WRITE:
+    # integer pieces are registers, written in decimal
+    def __init__(self, pieces: list[str | int]):
+        self.kind = IK_WRITE
+        self.pieces = pieces
+
+
+class I_CALL:
+    def __init__(self, label):
+        self.kind = IK_CALL
+        self.label = label
+
+
+class I_COUNT:
+    # bumps a profile counter, see pgo.py
+    def __init__(self, counter):
+        self.kind = IK_COUNT
+        self.counter = counter
+
+
+class I_ARGUMENT:
+    # register = the index-th argument the worker of a parallel loop was started with
+    def __init__(self, register, index):
+        self.kind = IK_ARGUMENT
+        self.register = register
+        self.index = index
+
+
+class I_PARALLEL:
+    """runs worker once per chunk, each chunk on its own thread, and writes what
+    they wrote in chunk order. chunks are (start, iterations, buffer offset), the
+    worker gets start and iterations as its arguments"""
+    def __init__(self, worker, chunks, buffer_size):
+        self.kind = IK_PARALLEL
+        self.worker = worker
+        self.chunks = chunks
+        self.buffer_size = buffer_size
+
+
+class I_JUMP:
+    def __init__(self, target):
+        self.kind = IK_JUMP
+        self.target = target
+
+
+class I_BRANCH:
+    def __init__(self, condition, register, value, then, otherwise):
+        self.kind = IK_BRANCH
+        self.condition = condition
+        self.register = register
+        self.value = value
+        self.then = then
+        self.otherwise = otherwise
+
+
+class I_RETURN:
+    def __init__(self):
+        self.kind = IK_RETURN
+
+
+class I_EXIT:
+    def __init__(self, code):
+        self.kind = IK_EXIT
+        self.code = code
+
+
+class I_END:
+    # leaves a top-level region, falling through to the next one
+    def __init__(self):
+        self.kind = IK_END
+
+
+class Block:
+    def __init__(self, prefix):
+        # the backend names the block's label after prefix
+        self.prefix = prefix
+        self.instructions = []
+        self.terminator = None
+        # how many times the block ran according to the profile, None when unknown
+        self.count = None
+        # cold blocks are placed after all the other code
+        self.cold = False
+
+    def successors(self):
+        if self.terminator.kind == IK_JUMP:
+            return [self.terminator.target]
+        if self.terminator.kind == IK_BRANCH:
+            return [self.terminator.then, self.terminator.otherwise]
+
+        return []
+
+
+class Function:
+    """a fn (label is set) or a top-level region of the program (label is None).
+    Workers run the body of a parallel loop, the backend names them"""
+    def __init__(self, label, worker=False):
+        self.label = label
+        self.worker = worker
+        self.blocks = []
+        self.registers = 0
+
+    def new_block(self, prefix):
+        block = Block(prefix)
+
+        self.blocks.append(block)
+
+        return block
+
+    def new_register(self):
+        self.registers += 1
+
+        return self.registers - 1
+
+    def predecessors(self):
+        predecessors = {id(block): [] for block in self.blocks}
+
+        for block in self.blocks:
+            for successor in block.successors():
+                predecessors[id(successor)].append(block)
+
+        return predecessors
+
+
+def format_instruction(instruction, names):
+    if instruction.kind == IK_CONST:
+        return f'v{instruction.register} = {instruction.value}'
+    if instruction.kind == IK_ADD:
+        return f'v{instruction.register} += {instruction.value}'
+    if instruction.kind == IK_WRITE:
+        return 'write ' + ', '.join(
+            f'v{piece}' if isinstance(piece, int) else repr(piece) for piece in instruction.pieces
+        )
+    if instruction.kind == IK_CALL:
+        return f'call {instruction.label}'
+    if instruction.kind == IK_COUNT:
+        return f'count #{instruction.counter}'
+    if instruction.kind == IK_ARGUMENT:
+        return f'v{instruction.register} = argument {instruction.index}'
+    if instruction.kind == IK_PARALLEL:
+        chunks = ', '.join(f'{start}+{iterations}' for start, iterations, _ in instruction.chunks)
+
+        return f'parallel {chunks}, buffer {instruction.buffer_size}'
+    if instruction.kind == IK_JUMP:
+        return f'jump {names[id(instruction.target)]}'
+    if instruction.kind == IK_BRANCH:
+        symbol = CONDITION_SYMBOLS[instruction.condition]
+        then = names[id(instruction.then)]
+        otherwise = names[id(instruction.otherwise)]
+
+        return f'if v{instruction.register} {symbol} {instruction.value} jump {then} else {otherwise}'
+    if instruction.kind == IK_EXIT:
+        return f'exit {instruction.code}'
+
+    return instruction.kind
+
+
+def format_function(function):
+    names = {id(block): f'{block.prefix}.{i}' for i, block in enumerate(function.blocks)}
+    if function.worker:
+        lines = ['worker:']
+    elif function.label is not None:
+        lines = [f'fn {function.label}:']
+    else:
+        lines = ['region:']
+
+    for block in function.blocks:
+        if block.count is None:
+            lines.append(f'  {names[id(block)]}:')
+        else:
+            cold = ', cold' if block.cold else ''
+            lines.append(f'  {names[id(block)]}:  ; count {block.count}{cold}')
+
+        for instruction in block.instructions + [block.terminator]:
+            lines.append(f'    {format_instruction(instruction, names)}')
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,456 @@
+import os
+import sys
+import mmap
+import ctypes
+import struct
+
+# Encodes the assembly generated by the Compiler straight into x86_64 machine
+# code, places it in executable memory and runs it in a fork of this process.
+# Only the instructions the Compiler emits are known, anything else raises
+# JitUnsupported so the caller can fall back to nasm and ld.
+
+REGISTERS = {
+    'rax': 0, 'rcx': 1, 'rdx': 2, 'rbx': 3, 'rsp': 4, 'rbp': 5, 'rsi': 6, 'rdi': 7,
+    'r8': 8, 'r9': 9, 'r10': 10, 'r11': 11, 'r12': 12, 'r13': 13, 'r14': 14, 'r15': 15,
+}
+
+CONDITION_CODES = {
+    'je': 0x4, 'jne': 0x5, 'jl': 0xC, 'jge': 0xD, 'jle': 0xE, 'jg': 0xF,
+}
+
+STACK_SIZE = 8 * 1024 * 1024
+
+SYS_EXIT = 0x3c
+
+# callee-saved registers are preserved for the caller (ctypes), rbp keeps the
+# caller's stack pointer while the program runs on its own stack
+ENTRY = [
+    'push rbx',
+    'push rbp',
+    'push r12',
+    'push r13',
+    'push r14',
+    'push r15',
+    'mov rbp,rsp',
+    'mov rsp,rdi',
+    'jmp _start',
+    # every syscall goes through here, so exit returns to python instead of
+    # terminating the whole process
+    '__jit_syscall:',
+    f'cmp rax,{SYS_EXIT}',
+    'je __jit_exit',
+    'syscall',
+    'ret',
+    '__jit_exit:',
+    'mov rax,rdi',
+    'mov rsp,rbp',
+    'pop r15',
+    'pop r14',
+    'pop r13',
+    'pop r12',
+    'pop rbp',
+    'pop rbx',
+    'ret',
+]
+
+
+class JitUnsupported(Exception):
+    pass
+
+
+def parse_number(text):
+    try:
+        return int(text, 0)
+    except ValueError:
+        return None
+
+
+def split_operands(text):
+    operands = []
+    current = ''
+    quoted = False
+
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        if char == ',' and not quoted:
+            operands.append(current.strip())
+            current = ''
+        else:
+            current += char
+
+    if current.strip() != '':
+        operands.append(current.strip())
+
+    return operands
+
+
+def rex(w, reg, rm):
+    value = 0x40 | (w << 3) | ((reg >> 3) << 2) | (rm >> 3)
+
+    return bytes([value]) if value != 0x40 else b''
+
+
+def modrm(mod, reg, rm):
+    return bytes([(mod << 6) | ((reg & 7) << 3) | (rm & 7)])
+
+
+def parse_memory(text):
+    """returns the displacement of a "qword [rsp+disp]" operand, None for anything else"""
+    if not text.startswith('qword [rsp') or not text.endswith(']'):
+        return None
+
+    displacement = text[len('qword [rsp'):-1]
+
+    if displacement == '':
+        return 0
+
+    return parse_number(displacement)
+
+
+def memory_operand(reg, displacement):
+    """modrm, sib and displacement addressing rsp+displacement"""
+    if displacement == 0:
+        return modrm(0, reg, 4) + b'\x24'
+    if -128 <= displacement < 128:
+        return modrm(1, reg, 4) + b'\x24' + struct.pack('<b', displacement)
+
+    return modrm(2, reg, 4) + b'\x24' + struct.pack('<i', displacement)
+
+
+def immediate(value):
+    """the opcode and encoded value of the 83 (imm8) or 81 (imm32) group forms"""
+    if -128 <= value < 128:
+        return b'\x83', struct.pack('<b', value)
+    if -2**31 <= value < 2**31:
+        return b'\x81', struct.pack('<i', value)
+
+    raise JitUnsupported(f'immediate {value} does not fit in 32 bits')
+
+
+class Module:
+    def __init__(self, lines):
+        self.text = []
+        self.data = []
+        self.labels = {}
+        self.globals = set()
+
+        section = 'text'
+
+        for line in lines:
+            line = line.strip()
+
+            if line == '' or line.startswith(';'):
+                continue
+
+            parts = line.split(None, 1)
+
+            if parts[0] == 'section':
+                # .bss holds the stacks and outputs of parallel loops, whose threads
+                # can't run inside the compiler process, and the digits of integer
+                # output, formatted by the runtime object that is never loaded here
+                if parts[1] == '.bss':
+                    raise JitUnsupported('.bss (parallel loops or integer output)')
+
+                section = 'data' if parts[1] == '.data' else 'text'
+            elif parts[0] == 'global':
+                self.globals.add(parts[1].strip())
+            elif parts[0] == 'extern':
+                continue
+            elif section == 'data':
+                self.data.append(line)
+            else:
+                self.text.append(line)
+
+
+class Assembler:
+    def __init__(self, modules):
+        self.modules = [Module(ENTRY)] + [Module(lines) for lines in modules]
+        self.globals = {}
+
+    def resolve(self, module, name):
+        if name in module.labels:
+            return module.labels[name]
+
+        if name in self.globals:
+            return self.globals[name]
+
+        raise JitUnsupported(f'unresolved symbol "{name}"')
+
+    def instruction(self, module, line, address, resolve):
+        """encodes one instruction. resolve is False while measuring sizes"""
+        parts = line.split(None, 1)
+        mnemonic = parts[0]
+        operands = split_operands(parts[1]) if len(parts) > 1 else []
+
+        def target(name):
+            return self.resolve(module, name) if resolve else address
+
+        if mnemonic == 'syscall':
+            # routed through __jit_syscall, see ENTRY
+            if module is self.modules[0]:
+                return b'\x0f\x05'
+
+            return b'\xe8' + struct.pack('<i', target('__jit_syscall') - (address + 5))
+
+        if mnemonic == 'ret' and len(operands) == 0:
+            return b'\xc3'
+
+        if mnemonic in ('push', 'pop') and len(operands) == 1:
+            reg = REGISTERS.get(operands[0])
+
+            if reg is not None:
+                base = 0x50 if mnemonic == 'push' else 0x58
+
+                return rex(0, 0, reg) + bytes([base + (reg & 7)])
+
+            value = parse_number(operands[0])
+
+            if mnemonic == 'push' and value is not None:
+                if -128 <= value < 128:
+                    return b'\x6a' + struct.pack('<b', value)
+                if -2**31 <= value < 2**31:
+                    return b'\x68' + struct.pack('<i', value)
+
+        if mnemonic in ('inc', 'dec') and len(operands) == 1 and operands[0] in REGISTERS:
+            reg = REGISTERS[operands[0]]
+
+            return rex(1, 0, reg) + b'\xff' + modrm(3, 0 if mnemonic == 'inc' else 1, reg)
+
+        if mnemonic in ('inc', 'dec') and len(operands) == 1 and operands[0].startswith('qword [rel '):
+            # profile counters, addressed relative to rip
+            name = operands[0][len('qword [rel '):-1]
+            displacement = 0
+
+            if '+' in name:
+                name, offset = name.split('+')
+                displacement = parse_number(offset)
+
+            encoded = rex(1, 0, 0) + b'\xff' + modrm(0, 0 if mnemonic == 'inc' else 1, 5)
+            end = address + len(encoded) + 4
+
+            return encoded + struct.pack('<i', target(name) + displacement - end)
+
+        if mnemonic in ('inc', 'dec', 'add', 'cmp', 'mov') and len(operands) > 0:
+            displacement = parse_memory(operands[0])
+
+            if displacement is not None:
+                return self.memory_instruction(mnemonic, displacement, operands[1:], line)
+
+        if mnemonic in ('add', 'sub') and len(operands) == 2 and operands[0] in REGISTERS:
+            reg = REGISTERS[operands[0]]
+            value = parse_number(operands[1])
+
+            if value is not None:
+                opcode, encoded = immediate(value)
+                extension = 0 if mnemonic == 'add' else 5
+
+                return rex(1, 0, reg) + opcode + modrm(3, extension, reg) + encoded
+
+        if mnemonic == 'cmp' and len(operands) == 2 and operands[0] in REGISTERS:
+            reg = REGISTERS[operands[0]]
+            value = parse_number(operands[1])
+
+            if value is not None:
+                if -128 <= value < 128:
+                    return rex(1, 0, reg) + b'\x83' + modrm(3, 7, reg) + struct.pack('<b', value)
+                if -2**31 <= value < 2**31:
+                    return rex(1, 0, reg) + b'\x81' + modrm(3, 7, reg) + struct.pack('<i', value)
+
+        if mnemonic == 'mov' and len(operands) == 2 and operands[0] in REGISTERS:
+            reg = REGISTERS[operands[0]]
+            source = operands[1]
+
+            if source in REGISTERS:
+                return rex(1, REGISTERS[source], reg) + b'\x89' + modrm(3, REGISTERS[source], reg)
+
+            value = parse_number(source)
+
+            if value is not None:
+                if 0 <= value < 2**32:
+                    return rex(0, 0, reg) + bytes([0xb8 + (reg & 7)]) + struct.pack('<I', value)
+                if -2**31 <= value < 0:
+                    return rex(1, 0, reg) + b'\xc7' + modrm(3, 0, reg) + struct.pack('<i', value)
+                if -2**63 <= value < 2**64:
+                    return rex(1, 0, reg) + bytes([0xb8 + (reg & 7)]) + struct.pack('<Q', value % 2**64)
+
+            # addresses are loaded relative to rip
+            encoded = rex(1, reg, 0) + b'\x8d' + modrm(0, reg, 5)
+            end = address + len(encoded) + 4
+
+            return encoded + struct.pack('<i', target(source) - end)
+
+        if mnemonic in ('jmp', 'call') and len(operands) == 1:
+            opcode = b'\xe9' if mnemonic == 'jmp' else b'\xe8'
+
+            return opcode + struct.pack('<i', target(operands[0]) - (address + 5))
+
+        if mnemonic in CONDITION_CODES and len(operands) == 1:
+            opcode = bytes([0x0f, 0x80 + CONDITION_CODES[mnemonic]])
+
+            return opcode + struct.pack('<i', target(operands[0]) - (address + 6))
+
+        raise JitUnsupported(f'unsupported instruction "{line}"')
+
+    def memory_instruction(self, mnemonic, displacement, operands, line):
+        """instructions on a stack slot, where the IR keeps its virtual registers"""
+        if mnemonic in ('inc', 'dec') and len(operands) == 0:
+            return rex(1, 0, 0) + b'\xff' + memory_operand(0 if mnemonic == 'inc' else 1, displacement)
+
+        if len(operands) != 1:
+            raise JitUnsupported(f'unsupported instruction "{line}"')
+
+        source = operands[0]
+
+        if source in REGISTERS:
+            reg = REGISTERS[source]
+            opcode = {'mov': b'\x89', 'add': b'\x01', 'cmp': b'\x39'}[mnemonic]
+
+            return rex(1, reg, 0) + opcode + memory_operand(reg, displacement)
+
+        value = parse_number(source)
+
+        if value is None:
+            raise JitUnsupported(f'unsupported instruction "{line}"')
+
+        if mnemonic == 'mov':
+            if not -2**31 <= value < 2**31:
+                raise JitUnsupported(f'immediate {value} does not fit in 32 bits')
+
+            return rex(1, 0, 0) + b'\xc7' + memory_operand(0, displacement) + struct.pack('<i', value)
+
+        opcode, encoded = immediate(value)
+        extension = 0 if mnemonic == 'add' else 7
+
+        return rex(1, 0, 0) + opcode + memory_operand(extension, displacement) + encoded
+
+    def data(self, module, line, resolve):
+        parts = line.split(None, 2)
+
+        if len(parts) < 2 or parts[1] not in ('db', 'dq'):
+            raise JitUnsupported(f'unsupported data "{line}"')
+
+        encoded = b''
+
+        for item in split_operands(parts[2] if len(parts) > 2 else ''):
+            if item.startswith('"') and item.endswith('"'):
+                if parts[1] != 'db':
+                    raise JitUnsupported(f'unsupported data "{line}"')
+
+                encoded += item[1:-1].encode('utf-8')
+                continue
+
+            value = parse_number(item)
+
+            if value is None:
+                value = self.resolve(module, item) if resolve else 0
+
+            if parts[1] == 'db':
+                encoded += struct.pack('<B', value & 0xff)
+            else:
+                encoded += struct.pack('<Q', value % 2**64)
+
+        return parts[0], encoded
+
+    def layout(self, base, data_base, resolve):
+        """returns the text and data bytes, placing the text at base and the data at data_base"""
+        text = bytearray()
+        data = bytearray()
+
+        for module in self.modules:
+            for line in module.text:
+                if line.endswith(':'):
+                    module.labels[line[:-1]] = base + len(text)
+                    continue
+
+                text += self.instruction(module, line, base + len(text), resolve)
+
+        for module in self.modules:
+            for line in module.data:
+                name, encoded = self.data(module, line, resolve)
+
+                module.labels[name] = data_base + len(data)
+                data += encoded
+
+        for module in self.modules:
+            for name in module.globals:
+                self.globals[name] = module.labels[name]
+
+        self.globals['_start'] = self.modules[-1].labels.get('_start')
+        self.globals['__jit_syscall'] = self.modules[0].labels['__jit_syscall']
+
+        return text, data
+
+
+def run(modules):
+    """runs the assembly of every module, the entry point last.
+    returns the exit code and everything the program wrote to stdout"""
+    assembler = Assembler(modules)
+
+    # every instruction has a fixed size: the first pass measures the text, the
+    # second places the labels and the last one resolves them
+    text, data = assembler.layout(0, 0, False)
+
+    page = mmap.PAGESIZE
+    text_size = (len(text) + page - 1) // page * page
+    data_size = (len(data) + page - 1) // page * page
+    size = text_size + data_size + STACK_SIZE
+
+    memory = mmap.mmap(-1, size, prot=mmap.PROT_READ | mmap.PROT_WRITE)
+    anchor = ctypes.c_char.from_buffer(memory)
+    base = ctypes.addressof(anchor)
+
+    assembler.layout(base, base + text_size, False)
+    text, data = assembler.layout(base, base + text_size, True)
+    memory[0:len(text)] = bytes(text)
+    memory[text_size:text_size + len(data)] = bytes(data)
+
+    libc = ctypes.CDLL(None, use_errno=True)
+    libc.mprotect.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int]
+
+    if libc.mprotect(base, text_size, mmap.PROT_READ | mmap.PROT_EXEC) != 0:
+        raise JitUnsupported('executable memory is not available')
+
+    entry = ctypes.CFUNCTYPE(ctypes.c_long, ctypes.c_void_p)(base)
+    stack_top = base + size
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    capture = os.memfd_create('sas-jit')
+
+    # the program runs in a child, so a crash only kills the child and the
+    # output it wrote before is still in the memfd
+    pid = os.fork()
+
+    if pid == 0:
+        code = 1
+
+        try:
+            os.dup2(capture, 1)
+            code = entry(stack_top) & 0xff
+        finally:
+            os._exit(code)
+
+    _, status = os.waitpid(pid, 0)
+
+    if os.WIFSIGNALED(status):
+        code = 128 + os.WTERMSIG(status)
+    else:
+        code = os.WEXITSTATUS(status)
+
+    os.lseek(capture, 0, os.SEEK_SET)
+
+    chunks = []
+    while True:
+        chunk = os.read(capture, 1 << 20)
+        if len(chunk) == 0:
+            break
+        chunks.append(chunk)
+
+    os.close(capture)
+
+    del entry, anchor
+    memory.close()
+
+    return code, b''.join(chunks)
@@ -1,8 +1,9 @@
-from constants import CHARS, NUMBERS
+from constants import CHARS, NUMBERS, KEYWORDS
 from utils import error
 from tokens import (
     T_EOF,
     T_SYMBOL,
+    T_KEYWORD,
     T_LEFT_PAREN,
     T_RIGHT_PAREN,
     T_LEFT_BRACKET,
@@ -28,6 +29,8 @@ class Tokenizer:
         self.size = len(self.content)
         self.bot = 0
         self.tokens = []
+        self.line = 1
+        self.line_start = 0
 
     def chr(self):
         if self.cursor >= self.size:
@@ -62,7 +65,14 @@ class Tokenizer:
         while self.is_symbol(self.chr()):
             self.advance_cursor()
 
-        self.tokens.append(T_SYMBOL(self.content[self.bot:self.cursor]))
+        name = self.content[self.bot:self.cursor]
+        kind = KEYWORDS.get(name)
+
+        # keywords are classified here so the parser never compares names
+        if kind is None:
+            self.tokens.append(T_SYMBOL(name))
+        else:
+            self.tokens.append(T_KEYWORD(name, kind))
 
     def tokenize_single(self):
         match self.chr():
@@ -124,11 +134,23 @@ class Tokenizer:
         while self.chr() is not None and self.chr() != '\n':
             self.advance_cursor()
 
+    def position(self):
+        """the (line, column) of self.bot. Tokens are read in order, so only the
+        text since the last call has to be scanned for line breaks"""
+        last = self.content.rfind('\n', self.line_start, self.bot)
+
+        if last != -1:
+            self.line += self.content.count('\n', self.line_start, last + 1)
+            self.line_start = last + 1
+
+        return self.line, self.bot - self.line_start + 1
+
     def tokenize(self):
         while True:
             self.trim_whitespaces()
 
             self.bot = self.cursor
+            first = len(self.tokens)
 
             if self.chr() is None:
                 self.tokens.append(T_EOF())
@@ -146,4 +168,10 @@ class Tokenizer:
             else:
                 error(f'unrecognized char {self.chr()}')
 
+            if len(self.tokens) > first:
+                position = self.position()
+
+                for token in self.tokens[first:]:
+                    token.position = position
+
         return self.tokens
@@ -0,0 +1,408 @@
+from nodes import (
+    N_FUNCTION_CALL,
+    N_IF_STATEMENT,
+    N_FOR_LOOP,
+    N_FN,
+    N_WRITE
+)
+from constants import (
+    KIND_NAMES,
+    K_STRING,
+    K_NUMBER,
+    K_SYMBOL,
+    K_LT,
+    K_GT,
+    K_PLUS_PLUS,
+    K_MINUS_MINUS,
+    INTEGER_SIZE,
+
+    NK_IF_STATEMENT,
+    NK_FOR_LOOP,
+    NK_FUNCTION_CALL,
+    NK_FN,
+    NK_IMPORT,
+    NK_WRITE,
+)
+from optimizer import loop_iterations
+from ir import (
+    CONDITIONS,
+    Function,
+    I_CONST,
+    I_ADD,
+    I_WRITE,
+    I_CALL,
+    I_JUMP,
+    I_BRANCH,
+    I_RETURN,
+    I_EXIT,
+    I_END,
+    I_COUNT,
+    I_ARGUMENT,
+    I_PARALLEL,
+)
+from pgo import counter_name
+from utils import error
+
+# the output of a parallel loop is kept in memory until every thread is done
+PARALLEL_OUTPUT_LIMIT = 1 << 30
+
+
+def piece_size(piece):
+    if piece.kind == K_SYMBOL:
+        return INTEGER_SIZE
+
+    return len(piece.value.encode('utf-8'))
+
+
+def check_parallel_body(nodes):
+    """the threads of a parallel loop only share their output buffers"""
+    for node in nodes:
+        if node.kind == NK_FUNCTION_CALL and node.name not in ('print', 'println'):
+            error(f'parallel loops can only call print and println, not "{node.name}"')
+        if node.kind == NK_FN:
+            error(f'function "{node.name}" can not be declared inside a parallel loop')
+        if node.kind == NK_FOR_LOOP and node.parallel:
+            error('parallel loops can not be nested')
+
+        check_parallel_body(node.body)
+
+        if node.kind == NK_IF_STATEMENT:
+            check_parallel_body(node.elze_block)
+
+
+def output_bound(nodes):
+    """the most bytes running nodes can write"""
+    size = 0
+
+    for node in nodes:
+        if node.kind == NK_WRITE:
+            size += sum(piece_size(piece) for piece in node.pieces)
+        elif node.kind == NK_FUNCTION_CALL:
+            if len(node.arguments) == 1 and node.arguments[0].kind in (K_STRING, K_SYMBOL):
+                size += piece_size(node.arguments[0]) + (node.name == 'println')
+        elif node.kind == NK_FOR_LOOP:
+            iterations = loop_iterations(node)
+
+            if iterations is None:
+                error('loops inside parallel loops must stop')
+
+            size += iterations * output_bound(node.body)
+        elif node.kind == NK_IF_STATEMENT:
+            size += max(output_bound(node.body), output_bound(node.elze_block))
+
+    return size
+
+
+class Lowerer:
+    """lowers the AST of a module into IR functions, one top-level item at a time"""
+    def __init__(self, module=None, imports={}, profile=None, threads=1):
+        # None for the program entry point, the import name for every other module
+        self.module = module
+        self.imports = imports
+        # a pgo.Profile, to instrument the code or to read the counts of its blocks
+        self.profile = profile
+        # how many threads run every parallel loop
+        self.threads = threads
+        self.fn_to_label = {}
+        self.fn_definitions = {}
+        self.function = None
+        self.block = None
+        self.functions = []
+
+    def function_label(self, name):
+        count = self.fn_definitions.get(name, 0)
+
+        self.fn_definitions[name] = count + 1
+
+        # exported functions are global symbols, so they carry the module name.
+        # Names can't contain dots, so the entry point and every module get labels
+        # no other one can produce
+        if self.module is None:
+            base = f'fn.{name}'
+        else:
+            base = f'fn.{self.module}.{name}'
+
+        # symbols can't contain digits, so the suffix never collides with another function
+        if count == 0:
+            return base
+
+        return f'{base}_{count}'
+
+    def count_site(self, node, site, counter):
+        """adds a profile counter to the current block when instrumenting, returns
+        what the counter counted when using a profile"""
+        if self.profile is None or node.position is None:
+            return None
+
+        name = counter_name(node, site, counter)
+
+        if self.profile.instrument:
+            self.block.instructions.append(I_COUNT(self.profile.counter(self.module, name)))
+
+            return None
+
+        return self.profile.count(self.module, name)
+
+    def terminate(self, terminator, prefix='bb'):
+        """closes the current block and returns a fresh one"""
+        self.block.terminator = terminator
+        self.block = self.function.new_block(prefix)
+
+        return self.block
+
+    def write_piece(self, piece, scope):
+        """loop variables are written as the register holding them"""
+        if piece.kind != K_SYMBOL:
+            return piece.value
+
+        if piece.value not in scope:
+            error(f'variable "{piece.value}" not found')
+
+        return scope[piece.value]
+
+    def lower_function_call(self, fn: N_FUNCTION_CALL, scope):
+        # builtin functions
+        if fn.name == 'println' or fn.name == 'print':
+            if len(fn.arguments) != 1:
+                error(f'print expects only one argument but got {len(fn.arguments)}')
+            if fn.arguments[0].kind not in (K_STRING, K_SYMBOL):
+                error(f'print expects a string or a loop variable but got {KIND_NAMES[fn.arguments[0].kind]}')
+
+            piece = self.write_piece(fn.arguments[0], scope)
+
+            if fn.name == 'println':
+                pieces = [piece + '\n'] if isinstance(piece, str) else [piece, '\n']
+            else:
+                pieces = [piece]
+
+            self.block.instructions.append(I_WRITE(pieces))
+        elif fn.name == 'exit':
+            if len(fn.arguments) != 1:
+                error(f'exit expects only one argument but got {len(fn.arguments)}')
+            if fn.arguments[0].kind != K_NUMBER:
+                error(f'exit expects one argument as number but got {KIND_NAMES[fn.arguments[0].kind]}')
+
+            # whatever follows is unreachable
+            self.terminate(I_EXIT(fn.arguments[0].value))
+        else:
+            if fn.name in self.fn_to_label:
+                self.block.instructions.append(I_CALL(self.fn_to_label[fn.name]))
+            else:
+                error(f'function "{fn.name}" does not exists')
+
+    def lower_write(self, node: N_WRITE, scope):
+        self.block.instructions.append(I_WRITE([self.write_piece(piece, scope) for piece in node.pieces]))
+
+    def lower_for_loop(self, loop: N_FOR_LOOP, scope):
+        if loop.parallel:
+            self.lower_parallel_for(loop, scope)
+            return
+
+        register = self.function.new_register()
+        loop_scope = {}
+
+        if loop.var_name is not None:
+            loop_scope[loop.var_name] = register
+
+        if loop.condition not in CONDITIONS:
+            error(f'invalid condition {KIND_NAMES[loop.condition]}')
+
+        self.block.instructions.append(I_CONST(register, loop.start))
+        self.count_site(loop, 'for', 'entries')
+
+        # the body always runs once, the condition is checked after the update
+        preheader = self.block
+        body = self.function.new_block('for')
+        self.block.terminator = I_JUMP(body)
+        self.block = body
+        body.count = self.count_site(loop, 'for', 'iterations')
+
+        for node in loop.body:
+            self.lower_node(node, loop_scope)
+
+        if loop.update == K_PLUS_PLUS:
+            self.block.instructions.append(I_ADD(register, 1))
+        elif loop.update == K_MINUS_MINUS:
+            self.block.instructions.append(I_ADD(register, -1))
+
+        end = self.function.new_block('bb')
+        end.count = preheader.count
+        self.block.terminator = I_BRANCH(CONDITIONS[loop.condition], register, loop.end, body, end)
+        self.block = end
+
+    def lower_parallel_for(self, loop: N_FOR_LOOP, scope):
+        """the body goes to a worker running a range of the iterations, every
+        thread runs one contiguous range"""
+        if loop.condition not in CONDITIONS:
+            error(f'invalid condition {KIND_NAMES[loop.condition]}')
+
+        iterations = loop_iterations(loop)
+
+        if iterations is None:
+            error('parallel loops must stop')
+
+        check_parallel_body(loop.body)
+
+        step = 1 if loop.update == K_PLUS_PLUS else -1
+        bound = output_bound(loop.body)
+
+        if bound * iterations > PARALLEL_OUTPUT_LIMIT:
+            error(f'parallel loop may write {bound * iterations} bytes, the limit is {PARALLEL_OUTPUT_LIMIT}')
+
+        threads = min(self.threads, iterations)
+        chunks = []
+        first = 0
+
+        for thread in range(threads):
+            size = iterations // threads + (thread < iterations % threads)
+            chunks.append((loop.start + first * step, size, first * bound))
+            first += size
+
+        self.count_site(loop, 'for', 'entries')
+
+        outer_function = self.function
+        outer_block = self.block
+
+        worker = Function(None, worker=True)
+        register = worker.new_register()
+        remaining = worker.new_register()
+        loop_scope = {}
+
+        if loop.var_name is not None:
+            loop_scope[loop.var_name] = register
+
+        self.function = worker
+        self.block = worker.new_block('bb')
+        self.block.instructions.append(I_ARGUMENT(register, 0))
+        self.block.instructions.append(I_ARGUMENT(remaining, 1))
+        self.functions.append(worker)
+
+        body = worker.new_block('for')
+        self.block.terminator = I_JUMP(body)
+        self.block = body
+        body.count = self.count_site(loop, 'for', 'iterations')
+
+        for node in loop.body:
+            self.lower_node(node, loop_scope)
+
+        self.block.instructions.append(I_ADD(register, step))
+        self.block.instructions.append(I_ADD(remaining, -1))
+
+        end = worker.new_block('bb')
+        self.block.terminator = I_BRANCH('ne', remaining, 0, body, end)
+        end.terminator = I_RETURN()
+
+        self.function = outer_function
+        self.block = outer_block
+        self.block.instructions.append(I_PARALLEL(worker, chunks, bound * iterations))
+
+    def lower_if(self, node: N_IF_STATEMENT, scope):
+        if node.var_name not in scope:
+            error(f'variable "{node.var_name}" not found')
+
+        if node.operator not in (K_LT, K_GT):
+            error(f'invalid operator {KIND_NAMES[node.operator]}')
+
+        branch = self.block
+        evaluations = self.count_site(node, 'if', 'evaluations')
+
+        then = self.function.new_block('bb')
+        self.block = then
+        then.count = self.count_site(node, 'if', 'taken')
+        for child in node.body:
+            self.lower_node(child, scope)
+        then_exit = self.block
+
+        otherwise = None
+
+        if len(node.elze_block) > 0:
+            otherwise = self.function.new_block('else')
+            self.block = otherwise
+
+            if evaluations is not None and then.count is not None:
+                otherwise.count = evaluations - then.count
+
+            for child in node.elze_block:
+                self.lower_node(child, scope)
+            else_exit = self.block
+
+        end = self.function.new_block('endif')
+        end.count = branch.count if branch.count is not None else evaluations
+
+        branch.terminator = I_BRANCH(
+            CONDITIONS[node.operator],
+            scope[node.var_name],
+            node.value,
+            then,
+            otherwise or end
+        )
+        then_exit.terminator = I_JUMP(end)
+
+        if otherwise is not None:
+            else_exit.terminator = I_JUMP(end)
+
+        self.block = end
+
+    def lower_fn(self, node: N_FN, scope):
+        fn_label = self.function_label(node.name)
+
+        self.fn_to_label[node.name] = fn_label
+
+        # functions declared inside other statements are hoisted out of them
+        outer_function = self.function
+        outer_block = self.block
+
+        self.function = Function(fn_label)
+        self.block = self.function.new_block('fn')
+        self.block.count = self.count_site(node, 'fn', 'calls')
+        self.functions.append(self.function)
+
+        for child in node.body:
+            self.lower_node(child, {})
+
+        self.block.terminator = I_RETURN()
+
+        self.function = outer_function
+        self.block = outer_block
+
+    def lower_node(self, node, scope):
+        if node.kind == NK_FUNCTION_CALL:
+            self.lower_function_call(node, scope)
+        elif node.kind == NK_FOR_LOOP:
+            self.lower_for_loop(node, scope)
+        elif node.kind == NK_IF_STATEMENT:
+            self.lower_if(node, scope)
+        elif node.kind == NK_FN:
+            self.lower_fn(node, scope)
+        elif node.kind == NK_WRITE:
+            self.lower_write(node, scope)
+        elif node.kind == NK_IMPORT:
+            error(f'module "{node.name}" must be imported at the top level')
+        else:
+            error(f'unhandled node kind {node.kind}')
+
+    def lower_import(self, node):
+        self.fn_to_label.update(self.imports[node.name])
+
+    def lower_item(self, node):
+        """returns the IR functions of a top-level item. Everything that isn't
+        a fn becomes a region of the program entry point"""
+        self.functions = []
+
+        if node.kind == NK_FN:
+            self.function = None
+            self.lower_fn(node, {})
+
+            return self.functions
+
+        if self.module is not None:
+            error(f'module "{self.module}" can only contain functions and imports')
+
+        region = Function(None)
+
+        self.function = region
+        self.block = region.new_block('bb')
+        self.lower_node(node, {})
+        self.block.terminator = I_END()
+
+        return [region] + self.functions
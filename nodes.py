@@ -1,4 +1,11 @@
-from constants import NK_FUNCTION_CALL, NK_FOR_LOOP, NK_IF_STATEMENT, NK_FN
+from constants import (
+    NK_FUNCTION_CALL,
+    NK_FOR_LOOP,
+    NK_IF_STATEMENT,
+    NK_FN,
+    NK_IMPORT,
+    NK_WRITE,
+)
 
 
 class N_FUNCTION_CALL_ARG:
@@ -13,14 +20,30 @@ class N_FUNCTION_CALL:
         self.kind = NK_FUNCTION_CALL
         self.arguments = arguments
 
+class N_WRITE:
+    # consecutive prints merged at compile time. pieces are N_FUNCTION_CALL_ARG,
+    # strings or loop variables
+    def __init__(self, pieces: list[N_FUNCTION_CALL_ARG]):
+        self.kind = NK_WRITE
+        self.pieces = pieces
+        self.body = []
+
 class N_FN:
-    def __init__(self, name, body=[]):
+    def __init__(self, name, body=[], position=None):
         self.name = name
         self.kind = NK_FN
         self.body = body
+        # (line, column) of the keyword, identifies the node in profiles
+        self.position = position
+
+class N_IMPORT:
+    def __init__(self, name):
+        self.name = name
+        self.kind = NK_IMPORT
+        self.body = []
 
 class N_FOR_LOOP:
-    def __init__(self, var_name, start, condition, end, update, body=[]):
+    def __init__(self, var_name, start, condition, end, update, body=[], position=None, parallel=False):
         self.var_name = var_name
         self.start = start
         self.end = end
@@ -28,13 +51,17 @@ class N_FOR_LOOP:
         self.update = update
         self.kind = NK_FOR_LOOP
         self.body = body
+        self.position = position
+        # parallel for, the iterations are split across threads
+        self.parallel = parallel
 
 
 class N_IF_STATEMENT:
-    def __init__(self, var_name, operator, value, body):
+    def __init__(self, var_name, operator, value, body, position=None):
         self.kind = NK_IF_STATEMENT
         self.var_name = var_name
         self.operator = operator
         self.value = value
         self.body = body
         self.elze_block = []
+        self.position = position
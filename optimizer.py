@@ -0,0 +1,191 @@
+import copy
+from constants import (
+    K_STRING,
+    K_SYMBOL,
+    K_LT,
+    K_GT,
+    K_EQ,
+    K_NOTEQ,
+    K_PLUS_PLUS,
+    K_MINUS_MINUS,
+
+    NK_FUNCTION_CALL,
+    NK_FOR_LOOP,
+    NK_IF_STATEMENT,
+    NK_FN,
+    NK_WRITE,
+)
+from nodes import N_FUNCTION_CALL_ARG, N_WRITE, N_FOR_LOOP
+
+
+def loop_iterations(loop):
+    """returns how many times the body of a loop runs, None when it never stops.
+
+    The body always runs once, the condition is only checked after the update"""
+    step = 1 if loop.update == K_PLUS_PLUS else -1
+    distance = (loop.end - loop.start) * step
+
+    if loop.condition == K_LT:
+        if step < 0:
+            return None if loop.start - 1 < loop.end else 1
+
+        return max(1, distance)
+    if loop.condition == K_GT:
+        if step > 0:
+            return None if loop.start + 1 > loop.end else 1
+
+        return max(1, distance)
+    if loop.condition == K_NOTEQ:
+        return distance if distance >= 1 else None
+    if loop.condition == K_EQ:
+        return 2 if distance == 1 else 1
+
+    return None
+
+
+def loop_over(var_name, first, last, step, body):
+    """a loop running body for every value from first to last"""
+    if step > 0:
+        return N_FOR_LOOP(var_name, first, K_LT, last + 1, K_PLUS_PLUS, body)
+
+    return N_FOR_LOOP(var_name, first, K_GT, last - 1, K_MINUS_MINUS, body)
+
+
+def unswitch_loop(loop):
+    """splits a loop whose body branches on the loop variable into one loop per
+    outcome of the branch. Returns the list of loops replacing it"""
+    if loop.var_name is None:
+        return [loop]
+
+    iterations = loop_iterations(loop)
+
+    if iterations is None:
+        return [loop]
+
+    # every loop variable has its own slot, so whatever runs before the if
+    # can't change the value it tests
+    for index, node in enumerate(loop.body):
+        if node.kind == NK_IF_STATEMENT and node.var_name == loop.var_name:
+            break
+    else:
+        return [loop]
+
+    branch = loop.body[index]
+    step = 1 if loop.update == K_PLUS_PLUS else -1
+    last = loop.start + (iterations - 1) * step
+
+    def taken(value):
+        if branch.operator == K_LT:
+            return value < branch.value
+
+        return value > branch.value
+
+    # the variable is monotonic, so the branch changes outcome at most once:
+    # search for the first iteration with a different outcome
+    low = 1
+    high = iterations
+
+    while low < high:
+        middle = (low + high) // 2
+
+        if taken(loop.start + middle * step) == taken(loop.start):
+            low = middle + 1
+        else:
+            high = middle
+
+    split = loop.start + low * step
+    runs = [(loop.start, split - step, taken(loop.start))]
+
+    if low < iterations:
+        runs.append((split, last, not taken(loop.start)))
+
+    loops = []
+
+    for first, end, outcome in runs:
+        chosen = branch.body if outcome else branch.elze_block
+        body = copy.deepcopy(loop.body[:index] + chosen + loop.body[index + 1:])
+
+        # the variable only lives inside the loop, so an empty one does nothing
+        if len(body) == 0:
+            continue
+
+        split_loop = loop_over(loop.var_name, first, end, step, body)
+        # every part still counts as the original loop in profiles
+        split_loop.position = loop.position
+        split_loop.parallel = loop.parallel
+
+        loops.extend(unswitch_loop(split_loop))
+
+    return loops
+
+
+def unswitch_loops(body):
+    result = []
+
+    for node in body:
+        if node.kind in (NK_FOR_LOOP, NK_FN):
+            node.body = unswitch_loops(node.body)
+        elif node.kind == NK_IF_STATEMENT:
+            node.body = unswitch_loops(node.body)
+            node.elze_block = unswitch_loops(node.elze_block)
+
+        if node.kind == NK_FOR_LOOP:
+            result.extend(unswitch_loop(node))
+        else:
+            result.append(node)
+
+    return result
+
+
+def print_pieces(node):
+    """returns the pieces written by a valid print/println call, None otherwise"""
+    if node.kind != NK_FUNCTION_CALL or node.name not in ('print', 'println'):
+        return None
+
+    # invalid calls are left alone so the compiler reports them
+    if len(node.arguments) != 1 or node.arguments[0].kind not in (K_STRING, K_SYMBOL):
+        return None
+
+    argument = node.arguments[0]
+    pieces = [N_FUNCTION_CALL_ARG(argument.value, argument.kind)]
+
+    if node.name == 'println':
+        pieces.append(N_FUNCTION_CALL_ARG('\n', K_STRING))
+
+    return pieces
+
+
+def coalesce_prints(body):
+    """merges straight-line runs of print/println into a single N_WRITE"""
+    result = []
+
+    for node in body:
+        if node.kind in (NK_FOR_LOOP, NK_FN):
+            node.body = coalesce_prints(node.body)
+        elif node.kind == NK_IF_STATEMENT:
+            node.body = coalesce_prints(node.body)
+            node.elze_block = coalesce_prints(node.elze_block)
+
+        pieces = print_pieces(node)
+
+        if pieces is None:
+            result.append(node)
+            continue
+
+        if len(result) == 0 or result[-1].kind != NK_WRITE:
+            result.append(N_WRITE([]))
+
+        write = result[-1]
+
+        for piece in pieces:
+            # adjacent literals always end up in the same buffer
+            if piece.kind == K_STRING and len(write.pieces) > 0 and write.pieces[-1].kind == K_STRING:
+                write.pieces[-1].value += piece.value
+            else:
+                write.pieces.append(piece)
+
+    return result
+
+
+def optimize(nodes):
+    return coalesce_prints(unswitch_loops(nodes))
@@ -15,16 +15,46 @@ from constants import (
     K_NOTEQ,
     K_PLUS_PLUS,
     K_MINUS_MINUS,
+    K_FOR,
+    K_IF,
+    K_ELSE,
+    K_FN,
+    K_AS,
+    K_IMPORT,
+    K_PARALLEL,
+
+    KIND_NAMES,
 )
 from nodes import (
     N_FUNCTION_CALL,
     N_FUNCTION_CALL_ARG,
     N_IF_STATEMENT,
     N_FOR_LOOP,
-    N_FN
+    N_FN,
+    N_IMPORT
 )
 from utils import error
 
+# sets of expected token kinds, built once instead of on every expect_next
+LEFT_PAREN = frozenset({K_LEFT_PAREN})
+RIGHT_PAREN = frozenset({K_RIGHT_PAREN})
+LEFT_BRACKET = frozenset({K_LEFT_BRACKET})
+RIGHT_BRACKET = frozenset({K_RIGHT_BRACKET})
+SEMI_COLON = frozenset({K_SEMI_COLON})
+SYMBOL = frozenset({K_SYMBOL})
+NUMBER = frozenset({K_NUMBER})
+ELSE = frozenset({K_ELSE})
+FOR = frozenset({K_FOR})
+LOOP_VARIABLE = frozenset({K_SEMI_COLON, K_AS})
+LOOP_CONDITION = frozenset({K_LT, K_GT, K_EQ, K_NOTEQ})
+LOOP_UPDATE = frozenset({K_PLUS_PLUS, K_MINUS_MINUS})
+IF_OPERATOR = frozenset({K_GT, K_LT})
+ARGUMENT = frozenset({K_STRING, K_NUMBER, K_SYMBOL})
+
+
+def kind_names(kinds):
+    return ' or '.join(KIND_NAMES[kind] for kind in sorted(kinds))
+
 
 class Parser:
     def __init__(self, tokens):
@@ -52,25 +82,19 @@ class Parser:
         token = self.token()
 
         if token is None:
-            error(f'missing token {kind}')
+            error(f'missing token {KIND_NAMES[kind]}')
 
-        if self.token().kind != kind:
-            error(f'expected "{kind}" but received "{token.kind}"')
+        if token.kind != kind:
+            error(f'expected "{KIND_NAMES[kind]}" but received "{KIND_NAMES[token.kind]}"')
 
-    def expect_next(self, *kinds):
-        if self.cursor >= self.size:
-            error(f'missing next token {" or ".join(kinds)}')
+    def expect_next(self, kinds: frozenset):
+        if self.cursor + 1 >= self.size:
+            error(f'missing next token {kind_names(kinds)}')
 
         nxt = self.tokens[self.cursor + 1]
 
-        found = False
-        for kind in kinds:
-            if nxt.kind == kind:
-                found = True
-                break
-
-        if not found:
-            error(f'expected "{" or ".join(kinds)}" but received "{nxt.kind}"')
+        if nxt.kind not in kinds:
+            error(f'expected "{kind_names(kinds)}" but received "{KIND_NAMES[nxt.kind]}"')
 
         self.next_token()
 
@@ -78,7 +102,7 @@ class Parser:
 
     def parse_function_call(self):
         name = self.token()
-        self.expect_next(K_LEFT_PAREN)
+        self.expect_next(LEFT_PAREN)
 
         self.next_token()
 
@@ -87,37 +111,33 @@ class Parser:
         while self.token() is not None and self.token().kind != K_RIGHT_PAREN:
             token = self.token()
 
-            if token.kind == K_STRING:
-                arguments.append(N_FUNCTION_CALL_ARG(token.name, K_STRING))
-            elif token.kind == K_NUMBER:
-                arguments.append(N_FUNCTION_CALL_ARG(token.name, K_NUMBER))
-            else:
-                error(f'unhandled data type {token.kind}')
+            if token.kind not in ARGUMENT:
+                error(f'unhandled data type {KIND_NAMES[token.kind]}')
+
+            arguments.append(N_FUNCTION_CALL_ARG(token.name, token.kind))
 
             self.next_token()
 
         self.expect_current(K_RIGHT_PAREN)
-        self.expect_next(K_SEMI_COLON)
+        self.expect_next(SEMI_COLON)
 
         return N_FUNCTION_CALL(name.name, arguments)
 
     def parse_for_loop(self):
-        start_value = self.expect_next(K_NUMBER)
-        az = self.expect_next(K_SEMI_COLON, K_SYMBOL)
+        position = self.token().position
+        start_value = self.expect_next(NUMBER)
+        az = self.expect_next(LOOP_VARIABLE)
         var_name = None
-        if az.kind == K_SYMBOL:
-            if az.name != 'as':
-                error(f'invalid syntax {az.name}')
-
-            var_name = self.expect_next(K_SYMBOL)
-            self.expect_next(K_SEMI_COLON)
+        if az.kind == K_AS:
+            var_name = self.expect_next(SYMBOL)
+            self.expect_next(SEMI_COLON)
         # condition. hardcoded for now
-        condition = self.expect_next(K_LT, K_GT, K_EQ, K_NOTEQ)
-        end_value = self.expect_next(K_NUMBER)
-        self.expect_next(K_SEMI_COLON)
+        condition = self.expect_next(LOOP_CONDITION)
+        end_value = self.expect_next(NUMBER)
+        self.expect_next(SEMI_COLON)
         # update. hardcoded for now
-        update = self.expect_next(K_PLUS_PLUS, K_MINUS_MINUS)
-        self.expect_next(K_LEFT_BRACKET)
+        update = self.expect_next(LOOP_UPDATE)
+        self.expect_next(LEFT_BRACKET)
         ntoken = self.ttoken()
 
         var_name = var_name.name if var_name is not None else None
@@ -125,7 +145,7 @@ class Parser:
         if ntoken is None:
             error('missing close bracket on for-loop')
         if ntoken.kind == K_RIGHT_BRACKET:
-            self.expect_next(K_RIGHT_BRACKET)
+            self.expect_next(RIGHT_BRACKET)
             return None
 
         body = []
@@ -148,22 +168,33 @@ class Parser:
             condition.kind,
             int(end_value.name),
             update.kind,
-            body
+            body,
+            position
         )
 
+    def parse_parallel(self):
+        self.expect_next(FOR)
+        loop = self.parse_for_loop()
+
+        if loop is not None:
+            loop.parallel = True
+
+        return loop
+
     def parse_if(self):
         # For now, it's hard coded syntax <symbol> <operator> <number>
-        var_name = self.expect_next(K_SYMBOL)
-        operator = self.expect_next(K_GT, K_LT)
-        value = self.expect_next(K_NUMBER)
-        self.expect_next(K_LEFT_BRACKET)
+        position = self.token().position
+        var_name = self.expect_next(SYMBOL)
+        operator = self.expect_next(IF_OPERATOR)
+        value = self.expect_next(NUMBER)
+        self.expect_next(LEFT_BRACKET)
 
         ttoken = self.ttoken()
 
         if ttoken is None:
             error('missing close bracket on if-statement')
         if ttoken.kind == K_RIGHT_BRACKET:
-            self.expect_next(K_RIGHT_BRACKET)
+            self.expect_next(RIGHT_BRACKET)
 
             return None
 
@@ -186,15 +217,16 @@ class Parser:
             var_name.name,
             operator.kind,
             value.name,
-            body
+            body,
+            position
         )
 
-        if self.ttoken().kind == K_SYMBOL and self.ttoken().name == 'else':
-            self.expect_next(K_SYMBOL)
-            self.expect_next(K_LEFT_BRACKET)
+        if self.ttoken().kind == K_ELSE:
+            self.expect_next(ELSE)
+            self.expect_next(LEFT_BRACKET)
 
             if self.ttoken().kind == K_RIGHT_BRACKET:
-                self.expect_next(K_RIGHT_BRACKET)
+                self.expect_next(RIGHT_BRACKET)
 
                 return iv
 
@@ -214,17 +246,19 @@ class Parser:
         return iv
 
     def parse_fn(self):
-        fn_name = self.expect_next(K_SYMBOL)
-        self.expect_next(K_LEFT_PAREN)
-        self.expect_next(K_RIGHT_PAREN)
-        self.expect_next(K_LEFT_BRACKET)
+        position = self.token().position
+        fn_name = self.expect_next(SYMBOL)
+        self.expect_next(LEFT_PAREN)
+        self.expect_next(RIGHT_PAREN)
+        self.expect_next(LEFT_BRACKET)
 
         if self.ttoken().kind == K_RIGHT_BRACKET:
-            self.expect_next(K_RIGHT_BRACKET)
+            self.expect_next(RIGHT_BRACKET)
 
             return N_FN(
                 fn_name.name,
-                []
+                [],
+                position
             )
 
         self.next_token()
@@ -244,20 +278,20 @@ class Parser:
 
         return N_FN(
             fn_name.name,
-            body
+            body,
+            position
         )
 
 
+    def parse_import(self):
+        module_name = self.expect_next(SYMBOL)
+        self.expect_next(SEMI_COLON)
+
+        return N_IMPORT(module_name.name)
+
     def parse_symbol(self):
         token = self.token()
 
-        if token.name == 'for':
-            return self.parse_for_loop()
-        if token.name == 'if':
-            return self.parse_if()
-        if token.name == 'fn':
-            return self.parse_fn()
-
         if not self.has_next_token():
             error(f'invalid use of symbol "{token.name}"')
 
@@ -268,15 +302,17 @@ class Parser:
 
         error(f'unexpected syntax "{ttoken.name}"')
 
+    def parse_eof(self):
+        return None
+
     def parse_expression(self):
         token = self.token()
+        rule = STATEMENTS.get(token.kind)
 
-        if token.kind == K_SYMBOL:
-            return self.parse_symbol()
-        elif token.kind == K_EOF:
-            return None
-        else:
-            error(f'unrecognized symbol {token.kind}')
+        if rule is None:
+            error(f'unrecognized symbol {KIND_NAMES[token.kind]}')
+
+        return rule(self)
 
     def parse(self):
         while self.cursor < self.size:
@@ -290,3 +326,16 @@ class Parser:
                 self.nodes.append(node)
 
         return self.nodes
+
+
+# LL(1) dispatch: the kind of the first token of a statement selects its rule.
+# The keys are the FIRST set of a statement
+STATEMENTS = {
+    K_SYMBOL: Parser.parse_symbol,
+    K_FOR: Parser.parse_for_loop,
+    K_IF: Parser.parse_if,
+    K_FN: Parser.parse_fn,
+    K_IMPORT: Parser.parse_import,
+    K_PARALLEL: Parser.parse_parallel,
+    K_EOF: Parser.parse_eof,
+}
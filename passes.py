@@ -0,0 +1,153 @@
+import sys
+import time
+from constants import (
+    IK_CONST,
+    IK_ADD,
+    IK_JUMP,
+    IK_BRANCH,
+    IK_ARGUMENT,
+)
+from ir import I_JUMP, evaluate, format_function
+
+
+def remove_unreachable_blocks(function):
+    """drops the blocks that can't be reached from the entry block, like the
+    code following an exit"""
+    reachable = set()
+    pending = [function.blocks[0]]
+
+    while len(pending) > 0:
+        block = pending.pop()
+
+        if id(block) in reachable:
+            continue
+
+        reachable.add(id(block))
+        pending.extend(block.successors())
+
+    function.blocks = [block for block in function.blocks if id(block) in reachable]
+
+
+def thread_jumps(function):
+    """makes jumps to empty blocks go straight to where those blocks jump"""
+    def destination(block):
+        seen = set()
+
+        while (
+            len(block.instructions) == 0
+            and block.terminator.kind == IK_JUMP
+            and id(block) not in seen
+        ):
+            seen.add(id(block))
+            block = block.terminator.target
+
+        return block
+
+    for block in function.blocks:
+        terminator = block.terminator
+
+        if terminator.kind == IK_JUMP:
+            terminator.target = destination(terminator.target)
+        elif terminator.kind == IK_BRANCH:
+            terminator.then = destination(terminator.then)
+            terminator.otherwise = destination(terminator.otherwise)
+
+    remove_unreachable_blocks(function)
+
+
+def fold_constant_branches(function):
+    """replaces branches on registers whose value is known in the block by jumps"""
+    for block in function.blocks:
+        known = {}
+
+        for instruction in block.instructions:
+            if instruction.kind == IK_CONST:
+                known[instruction.register] = instruction.value
+            elif instruction.kind == IK_ADD and instruction.register in known:
+                known[instruction.register] += instruction.value
+            elif instruction.kind == IK_ARGUMENT:
+                known.pop(instruction.register, None)
+
+        terminator = block.terminator
+
+        if terminator.kind == IK_BRANCH and terminator.register in known:
+            if evaluate(terminator.condition, known[terminator.register], terminator.value):
+                block.terminator = I_JUMP(terminator.then)
+            else:
+                block.terminator = I_JUMP(terminator.otherwise)
+
+    remove_unreachable_blocks(function)
+
+
+def merge_blocks(function):
+    """appends a block to its only predecessor when that one jumps straight to it"""
+    predecessors = function.predecessors()
+    merged = set()
+
+    for block in function.blocks:
+        if id(block) in merged:
+            continue
+
+        while block.terminator.kind == IK_JUMP:
+            successor = block.terminator.target
+
+            if (
+                successor is block
+                or successor is function.blocks[0]
+                or len(predecessors[id(successor)]) != 1
+            ):
+                break
+
+            block.instructions.extend(successor.instructions)
+            block.terminator = successor.terminator
+            merged.add(id(successor))
+
+            # the blocks successor jumped to now come from block
+            for following in block.successors():
+                predecessors[id(following)] = [
+                    block if predecessor is successor else predecessor
+                    for predecessor in predecessors[id(following)]
+                ]
+
+    function.blocks = [block for block in function.blocks if id(block) not in merged]
+
+
+DEFAULT_PASSES = [
+    remove_unreachable_blocks,
+    fold_constant_branches,
+    thread_jumps,
+    merge_blocks,
+]
+
+
+class PassManager:
+    def __init__(self, passes=DEFAULT_PASSES, dump=False, timing=False):
+        self.passes = passes
+        self.dump = dump
+        self.timing = timing
+        self.timings = {run_pass.__name__: 0.0 for run_pass in passes}
+
+    def run(self, function):
+        for run_pass in self.passes:
+            if self.timing:
+                start = time.perf_counter()
+                run_pass(function)
+                self.timings[run_pass.__name__] += time.perf_counter() - start
+            else:
+                run_pass(function)
+
+        if self.dump:
+            sys.stderr.write(format_function(function))
+
+    def report(self):
+        if not self.timing:
+            return
+
+        total = sum(self.timings.values())
+
+        sys.stderr.write('pass timings:\n')
+
+        for name, elapsed in self.timings.items():
+            sys.stderr.write(f'  {name:<28} {elapsed * 1000:10.3f} ms\n')
+
+        sys.stderr.write(f'  {"total":<28} {total * 1000:10.3f} ms\n')
@@ -0,0 +1,375 @@
+import copy
+import struct
+from constants import (
+    IK_CONST,
+    IK_ADD,
+    IK_WRITE,
+    IK_CALL,
+    IK_JUMP,
+    IK_BRANCH,
+    IK_RETURN,
+    IK_COUNT,
+    IK_PARALLEL,
+)
+from ir import I_ADD, I_WRITE, I_JUMP, evaluate
+from utils import error
+
+# Profile guided optimization. A --profile-generate build counts how many times
+# every fn, for and if of the program ran and writes the counts to
+# PROFILE_FILE when it exits. --profile-use reads them back to decide what to
+# inline, what to unroll and where to place every block.
+#
+# Counters are named after the source position of their node, so a profile
+# stays valid for the same source no matter how the labels are generated:
+#
+#   <module> <number of counters>\n
+#   <line>:<column>:<site>:<counter>\n      once per counter
+#   <counter values, 8 bytes little endian each>
+#
+# repeated for every instrumented module.
+
+PROFILE_FILE = 'profile.data'
+
+# the entry point has no import name
+PROGRAM = '<program>'
+
+# blocks running at least 1/HOT_FRACTION as often as the hottest site are hot
+HOT_FRACTION = 100
+# instructions of the biggest function inlined into a hot block
+INLINE_SIZE = 16
+# instructions of the biggest unrolled loop body, and the most copies of it
+UNROLL_SIZE = 32
+UNROLL_FACTOR = 8
+
+
+def module_tag(module):
+    return PROGRAM if module is None else module
+
+
+def counter_name(node, site, counter):
+    line, column = node.position
+
+    return f'{line}:{column}:{site}:{counter}'
+
+
+class Profile:
+    """the counters of an instrumented build (counts is None) or the counts read
+    back from the profile of one"""
+    def __init__(self, counts=None):
+        self.instrument = counts is None
+        # {module tag: {counter name: count}}
+        self.counts = counts or {}
+        # {module tag: [counter name]}, in the order the counters were created
+        self.counters = {}
+
+    def counter(self, module, name):
+        """returns the index of the counter in its module"""
+        names = self.counters.setdefault(module_tag(module), [])
+
+        if name not in names:
+            names.append(name)
+
+        return names.index(name)
+
+    def count(self, module, name):
+        return self.counts.get(module_tag(module), {}).get(name)
+
+    def header(self, module):
+        names = self.counters.get(module_tag(module), [])
+
+        return f'{module_tag(module)} {len(names)}\n' + ''.join(f'{name}\n' for name in names)
+
+    def hottest(self):
+        return max((count for counts in self.counts.values() for count in counts.values()), default=0)
+
+
+def format_profile(profile, values):
+    """values are the counter values of every module, by module tag"""
+    data = b''
+
+    for tag, names in profile.counters.items():
+        data += f'{tag} {len(names)}\n'.encode('utf-8')
+        data += ''.join(f'{name}\n' for name in names).encode('utf-8')
+        data += struct.pack(f'<{len(names)}Q', *values[tag])
+
+    return data
+
+
+def read_profile(path):
+    try:
+        data = open(path, 'rb').read()
+    except OSError:
+        error(f'could not read profile "{path}"')
+
+    counts = {}
+    offset = 0
+
+    try:
+        while offset < len(data):
+            end = data.index(b'\n', offset)
+            tag, size = data[offset:end].decode('utf-8').split(' ')
+            offset = end + 1
+            names = []
+
+            for _ in range(int(size)):
+                end = data.index(b'\n', offset)
+                names.append(data[offset:end].decode('utf-8'))
+                offset = end + 1
+
+            values = struct.unpack_from(f'<{len(names)}Q', data, offset)
+            offset += 8 * len(names)
+            counts[tag] = dict(zip(names, values))
+    except (ValueError, struct.error):
+        error(f'invalid profile "{path}"')
+
+    return Profile(counts)
+
+
+def trip_count(start, step, condition, bound):
+    """how many times a loop body runs when its register starts at start and the
+    condition is checked after every update. None when it never stops"""
+    if not evaluate(condition, start + step, bound):
+        return 1
+
+    if condition == 'e':
+        return 2
+    if condition == 'ne':
+        distance = bound - start
+
+        return distance // step if distance % step == 0 and distance // step > 0 else None
+
+    if (condition in ('l', 'le')) != (step > 0):
+        return None
+
+    # first n where start + n * step fails the condition
+    distance = abs(bound - start)
+
+    return distance + 1 if condition in ('le', 'ge') else distance
+
+
+class ProfileGuidedPasses:
+    """IR passes driven by the block counts the Lowerer reads from a profile"""
+    def __init__(self, profile):
+        self.profile = profile
+        self.hot_count = max(1, profile.hottest() // HOT_FRACTION)
+        # functions already optimized, by label, for inlining
+        self.functions = {}
+
+    def is_hot(self, block):
+        return block.count is not None and block.count >= self.hot_count
+
+    def inline_candidate(self, function, block, instruction):
+        if instruction.kind != IK_CALL or not self.is_hot(block):
+            return None
+
+        callee = self.functions.get(instruction.label)
+
+        if callee is None or callee is function:
+            return None
+
+        size = 0
+
+        for callee_block in callee.blocks:
+            for callee_instruction in callee_block.instructions:
+                # only leaves, so nothing inlined can recurse or refer to labels
+                # that are private to another module, like parallel loop workers
+                if callee_instruction.kind in (IK_CALL, IK_PARALLEL):
+                    return None
+
+                size += 1
+
+        if size > INLINE_SIZE:
+            return None
+
+        return callee
+
+    def inline_hot_calls(self, function):
+        """replaces the calls to small functions in hot blocks by their body"""
+        pending = list(function.blocks)
+
+        while len(pending) > 0:
+            block = pending.pop(0)
+
+            for index, instruction in enumerate(block.instructions):
+                callee = self.inline_candidate(function, block, instruction)
+
+                if callee is None:
+                    continue
+
+                rest = copy.copy(block)
+                rest.prefix = 'bb'
+                rest.instructions = block.instructions[index + 1:]
+
+                blocks = copy.deepcopy(callee.blocks)
+                blocks[0].prefix = 'bb'
+                entry_count = callee.blocks[0].count or 1
+
+                for inlined in blocks:
+                    if inlined.count is not None:
+                        inlined.count = inlined.count * block.count // entry_count
+
+                    for callee_instruction in inlined.instructions + [inlined.terminator]:
+                        if callee_instruction.kind in (IK_CONST, IK_ADD, IK_BRANCH):
+                            callee_instruction.register += function.registers
+                        elif callee_instruction.kind == IK_WRITE:
+                            callee_instruction.pieces = [
+                                piece + function.registers if isinstance(piece, int) else piece
+                                for piece in callee_instruction.pieces
+                            ]
+
+                    if inlined.terminator.kind == IK_RETURN:
+                        inlined.terminator = I_JUMP(rest)
+
+                function.registers += callee.registers
+                block.instructions = block.instructions[:index]
+                block.terminator = I_JUMP(blocks[0])
+
+                position = function.blocks.index(block) + 1
+                function.blocks[position:position] = blocks + [rest]
+                pending.insert(0, rest)
+                break
+
+        if function.label is not None:
+            self.functions[function.label] = function
+
+    def unroll_hot_loops(self, function):
+        """repeats the body of hot single block loops whose trip count is known,
+        so the condition is checked once every few iterations"""
+        predecessors = function.predecessors()
+
+        for block in function.blocks:
+            terminator = block.terminator
+
+            if terminator.kind != IK_BRANCH or terminator.then is not block or not self.is_hot(block):
+                continue
+
+            register = terminator.register
+            updates = [
+                instruction for instruction in block.instructions
+                if instruction.kind in (IK_CONST, IK_ADD) and instruction.register == register
+            ]
+
+            if len(updates) != 1 or updates[0].kind != IK_ADD or updates[0].value == 0:
+                continue
+
+            # a copy of a parallel loop would copy its worker too
+            if any(instruction.kind == IK_PARALLEL for instruction in block.instructions):
+                continue
+
+            entries = [predecessor for predecessor in predecessors[id(block)] if predecessor is not block]
+
+            if len(entries) != 1 or entries[0].terminator.kind != IK_JUMP:
+                continue
+
+            preheader = entries[0]
+            start = None
+
+            for instruction in preheader.instructions:
+                if instruction.kind in (IK_CONST, IK_ADD) and instruction.register == register:
+                    start = instruction.value if instruction.kind == IK_CONST else None
+
+            if start is None:
+                continue
+
+            trips = trip_count(start, updates[0].value, terminator.condition, terminator.value)
+            factor = UNROLL_FACTOR
+
+            while factor > 1 and (len(block.instructions) * factor > UNROLL_SIZE or factor > (trips or 0)):
+                factor //= 2
+
+            if factor < 2:
+                continue
+
+            # the iterations that don't fill a whole unrolled body run before the loop
+            for _ in range(trips % factor):
+                preheader.instructions.extend(copy.deepcopy(block.instructions))
+
+            body = []
+
+            for _ in range(factor):
+                body.extend(copy.deepcopy(block.instructions))
+
+            block.instructions = combine_instructions(body, register)
+
+    def layout_blocks(self, function):
+        """places the hottest successor of every block right after it, so hot
+        paths fall through, and moves the blocks that never ran to the end of .text"""
+        for block in function.blocks:
+            block.cold = False
+
+        if all(block.count is None for block in function.blocks):
+            return
+
+        entry = function.blocks[0]
+        order = [entry]
+        placed = {id(entry)}
+        remaining = [block for block in function.blocks[1:] if block.count != 0]
+        cold = [block for block in function.blocks[1:] if block.count == 0]
+
+        while len(order) < len(remaining) + 1:
+            successors = [
+                successor for successor in order[-1].successors()
+                if id(successor) not in placed and successor.count != 0
+            ]
+
+            if len(successors) > 0:
+                following = max(successors, key=lambda successor: successor.count or 0)
+            else:
+                following = next(block for block in remaining if id(block) not in placed)
+
+            order.append(following)
+            placed.add(id(following))
+
+        for block in cold:
+            block.cold = True
+
+        # a fn that never ran goes to the end of .text as a whole
+        if function.label is not None and entry.count == 0:
+            for block in function.blocks:
+                block.cold = True
+
+        function.blocks = order + cold
+
+
+def join_pieces(pieces):
+    """merges the text pieces next to each other"""
+    joined = []
+
+    for piece in pieces:
+        if isinstance(piece, str) and len(joined) > 0 and isinstance(joined[-1], str):
+            joined[-1] += piece
+        else:
+            joined.append(piece)
+
+    return joined
+
+
+def combine_instructions(instructions, register):
+    """moves the updates of register to the end of the block as a single one and
+    merges the writes left next to each other"""
+    step = 0
+    combined = []
+
+    for instruction in instructions:
+        if instruction.kind == IK_ADD and instruction.register == register:
+            step += instruction.value
+            continue
+
+        # only the branch and the writes read registers, so the update can move
+        # past anything else
+        if instruction.kind not in (IK_WRITE, IK_CALL, IK_COUNT, IK_CONST, IK_ADD):
+            return instructions
+
+        if instruction.kind == IK_WRITE and register in instruction.pieces and step != 0:
+            combined.append(I_ADD(register, step))
+            step = 0
+
+        if instruction.kind == IK_WRITE and len(combined) > 0 and combined[-1].kind == IK_WRITE:
+            combined[-1] = I_WRITE(join_pieces(combined[-1].pieces + instruction.pieces))
+        else:
+            combined.append(instruction)
+
+    if step == 0:
+        return combined
+
+    return combined + [I_ADD(register, step)]
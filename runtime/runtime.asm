@@ -0,0 +1,85 @@
+;; runtime library linked into every program. It's assembled once and the
+;; object is kept in the codegen cache, see build() in compiler.py
+
+global __sas_format_int
+global __sas_append_int
+
+section .text
+
+;; writes the decimal digits of a signed integer right before the end of a
+;; buffer, two digits per step from a table of every pair of digits
+;;   in:  rdi value, rsi end of a buffer of at least 20 bytes
+;;   out: rax first char, rdx size
+;; clobbers rcx, rsi, r8, r9, r10
+__sas_format_int:
+    mov r8,rsi
+    mov r9,rdi
+    mov rax,rdi
+    test rax,rax
+    jns .pairs
+    ; the most negative value stays the same, but reads right as unsigned
+    neg rax
+.pairs:
+    cmp rax,100
+    jb .last
+    ; rdx = rax / 100: (rax / 4) * ceil(2^68 / 100) / 2^64 / 4
+    mov rcx,rax
+    shr rax,2
+    mov rdx,0x28f5c28f5c28f5c3
+    mul rdx
+    shr rdx,2
+    imul r10,rdx,100
+    sub rcx,r10
+    movzx r10d,word [__sas_digit_pairs+rcx*2]
+    sub rsi,2
+    mov word [rsi],r10w
+    mov rax,rdx
+    jmp .pairs
+.last:
+    cmp rax,10
+    jb .single
+    movzx r10d,word [__sas_digit_pairs+rax*2]
+    sub rsi,2
+    mov word [rsi],r10w
+    jmp .sign
+.single:
+    add al,0x30
+    dec rsi
+    mov byte [rsi],al
+.sign:
+    test r9,r9
+    jns .done
+    dec rsi
+    mov byte [rsi],0x2d
+.done:
+    mov rax,rsi
+    mov rdx,r8
+    sub rdx,rsi
+    ret
+
+;; appends the decimal digits of a signed integer to the output of a parallel
+;; loop worker
+;;   in:  rsi value, rdi output
+;;   out: rdi right after the digits
+;; clobbers rax, rcx, rdx, rsi, r8, r9, r10
+__sas_append_int:
+    sub rsp,32
+    push rdi
+    mov rdi,rsi
+    lea rsi,[rsp+40]
+    call __sas_format_int
+    pop rdi
+    mov rsi,rax
+    mov rcx,rdx
+    rep movsb
+    add rsp,32
+    ret
+
+section .data
+
+__sas_digit_pairs:
+    db "0001020304050607080910111213141516171819"
+    db "2021222324252627282930313233343536373839"
+    db "4041424344454647484950515253545556575859"
+    db "6061626364656667686970717273747576777879"
+    db "8081828384858687888990919293949596979899"
@@ -0,0 +1,43 @@
+import os
+import shutil
+import subprocess
+import sys
+import pytest
+
+COMPILER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'compiler.py')
+MODES = ('vm', 'native')
+
+
+@pytest.fixture
+def run_program(tmp_path):
+    """writes the files of a program to a temporary folder and returns a function
+    running its main.sas in the VM, the JIT or as a native executable built with
+    flags"""
+    def run(files, mode, flags=()):
+        for name, content in files.items():
+            (tmp_path / name).write_text(content)
+
+        if mode == 'vm':
+            command = [sys.executable, COMPILER, 'main.sas', '--run', *flags]
+        elif mode == 'jit':
+            command = [sys.executable, COMPILER, 'main.sas', '--jit', *flags]
+        else:
+            if shutil.which('nasm') is None or shutil.which('ld') is None:
+                pytest.skip('nasm and ld are needed for native builds')
+
+            build = subprocess.run(
+                [sys.executable, COMPILER, 'main.sas', '-o', 'main', *flags],
+                cwd=tmp_path,
+                capture_output=True,
+                text=True
+            )
+
+            # programs the compiler rejects fail the same way the VM does
+            if build.returncode != 0:
+                return build
+
+            command = [str(tmp_path / 'main')]
+
+        return subprocess.run(command, cwd=tmp_path, capture_output=True, text=True)
+
+    return run
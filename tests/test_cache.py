@@ -0,0 +1,43 @@
+import pytest
+
+MODES = ('jit', 'native')
+FLAGS = ('--cache-dir', 'cache')
+
+
+def cached_items(tmp_path):
+    return len(list((tmp_path / 'cache').glob('*.json')))
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_changed_callee_is_generated_again(run_program, tmp_path, mode):
+    caller = "fn f() {\n  g();\n}\n\nf();\n"
+
+    result = run_program({'main.sas': "fn g() {\n  println('one');\n}\n\n" + caller}, mode, FLAGS)
+
+    assert result.stdout == 'one\n'
+
+    items = cached_items(tmp_path)
+    result = run_program({'main.sas': "fn g() {\n  println('two');\n}\n\n" + caller}, mode, FLAGS)
+
+    assert result.stdout == 'two\n'
+    # the caller and the call are reused, only g is new
+    assert cached_items(tmp_path) == items + 1
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_redefined_function_is_generated_again(run_program, tmp_path, mode):
+    first = "fn g() {\n  println('first');\n}\n\ng();\n\n"
+    second = "fn g() {\n  println('second');\n}\n\ng();\n"
+
+    result = run_program({'main.sas': first + second}, mode, FLAGS)
+
+    assert result.stdout == 'first\nsecond\n'
+
+    result = run_program({'main.sas': first + second.replace('second', 'third')}, mode, FLAGS)
+
+    assert result.stdout == 'first\nthird\n'
+
+    # without the first definition the second one gets its label
+    result = run_program({'main.sas': second}, mode, FLAGS)
+
+    assert result.stdout == 'second\n'
@@ -0,0 +1,12 @@
+import pytest
+
+CRASH = "println('start');\n\nfn f() {\n  f();\n}\n\nf();\n"
+
+
+@pytest.mark.parametrize('mode', ('vm', 'jit'))
+def test_crash_keeps_output_and_reports_the_signal(run_program, mode):
+    result = run_program({'main.sas': CRASH}, mode, ('--no-cache',))
+
+    # 128 + SIGSEGV, like the shell reports for the native binary
+    assert result.returncode == 139
+    assert result.stdout == 'start\n'
@@ -0,0 +1,39 @@
+import pytest
+from conftest import MODES
+
+# loops branching on their variable are split where the branch changes its
+# outcome, the output must stay the one of the loop testing every iteration
+UNSWITCHED = [
+    # both updates
+    ("for 0 as i; < 6; ++ { if i > 2 { print('G'); } else { print('L'); } }", 'LLLGGG'),
+    ("for 5 as i; > 0; -- { if i < 3 { print('L'); } else { print('G'); } }", 'GGGLL'),
+    # every loop condition
+    ("for 0 as i; != 4; ++ { if i > 1 { print('G'); } else { print('L'); } }", 'LLGG'),
+    ("for 4 as i; != 0; -- { if i > 1 { print('G'); } else { print('L'); } }", 'GGGL'),
+    ("for 3 as i; == 4; ++ { if i > 3 { print('G'); } else { print('L'); } }", 'LG'),
+    ("for 3 as i; == 3; -- { if i > 2 { print('G'); } else { print('L'); } }", 'G'),
+    # split at the first iteration, at the last one and nowhere
+    ("for 0 as i; < 4; ++ { if i > 0 { print('G'); } else { print('L'); } }", 'LGGG'),
+    ("for 0 as i; < 4; ++ { if i > 2 { print('G'); } else { print('L'); } }", 'LLLG'),
+    ("for 0 as i; < 4; ++ { if i > 10 { print('G'); } else { print('L'); } }", 'LLLL'),
+    ("for 0 as i; < 4; ++ { if i < 10 { print('G'); } else { print('L'); } }", 'GGGG'),
+    # empty branches
+    ("for 0 as i; < 5; ++ { if i > 2 { print(i); } else { } print('.'); }", '...3.4.'),
+    ("for 0 as i; < 1000; ++ { if i < 1 { print('x'); } }", 'x'),
+    ("for 0 as i; < 4; ++ { if i > 10 { print('x'); } }", ''),
+    # the if comes after an inner loop and a call
+    (
+        "fn g() { print('g'); }\n"
+        "for 0 as i; < 3; ++ { g(); for 0; < 2; ++ { print('-'); } if i > 0 { print(i); } }",
+        'g--g--1g--2'
+    ),
+]
+
+
+@pytest.mark.parametrize('mode', MODES)
+@pytest.mark.parametrize('source, expected', UNSWITCHED)
+def test_unswitched_loop_output(run_program, mode, source, expected):
+    result = run_program({'main.sas': f"{source}\nprintln('');\n"}, mode)
+
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert result.stdout == expected + '\n'
@@ -0,0 +1,38 @@
+import pytest
+from conftest import MODES
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_entry_point_function_does_not_shadow_module_function(run_program, mode):
+    result = run_program({
+        'q.sas': "fn b() {\n  println('module');\n}\n",
+        'main.sas': "import q;\n\nfn q__b() {\n  println('local');\n}\n\nq__b();\nb();\n",
+    }, mode)
+
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert result.stdout == 'local\nmodule\n'
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_module_functions_get_distinct_labels(run_program, mode):
+    result = run_program({
+        'a_.sas': "fn _b() {\n  println('a_ _b');\n}\n",
+        'a.sas': "fn __b() {\n  println('a __b');\n}\n",
+        'main.sas': "import a_;\nimport a;\n\n_b();\n__b();\n",
+    }, mode)
+
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert result.stdout == 'a_ _b\na __b\n'
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_imported_functions_are_not_exported_again(run_program, mode):
+    result = run_program({
+        'r.sas': "fn x() {\n  println('x');\n}\n",
+        'q.sas': "import r;\n\nfn y() {\n  x();\n}\n",
+        'main.sas': "import q;\n\ny();\nx();\n",
+    }, mode)
+
+    assert result.returncode == 1
+    assert result.stdout == ''
+    assert 'function "x" does not exists' in result.stdout + result.stderr
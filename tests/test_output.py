@@ -0,0 +1,30 @@
+import pytest
+from conftest import MODES
+
+# consecutive prints of strings and loop variables are merged into one write,
+# the pieces that can't share a buffer are written by a single writev
+PIECES = """for 8 as i; < 12; ++ {
+  print('[');
+  print(i);
+  print('|');
+  print(i);
+  println(']');
+}
+"""
+
+
+@pytest.mark.parametrize('flags', [(), ('-Os',)])
+@pytest.mark.parametrize('mode', MODES)
+def test_merged_prints_write_every_piece_in_order(run_program, mode, flags):
+    result = run_program({'main.sas': PIECES}, mode, flags)
+
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert result.stdout == ''.join(f'[{i}|{i}]\n' for i in range(8, 12))
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_merged_prints_of_strings_only(run_program, mode):
+    result = run_program({'main.sas': "print('|');\nprint('-');\nprintln('|');\n"}, mode)
+
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert result.stdout == '|-|\n'
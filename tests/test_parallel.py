@@ -0,0 +1,20 @@
+import pytest
+from conftest import MODES
+
+LOOPS = [
+    "for 0 as i; < 100; ++ { if i > 49 { print('G'); } else { print('L'); } print(i); println(''); }",
+    "for 100 as i; > 0; -- { print(i); if i < 7 { println(' low'); } else { println(''); } }",
+]
+
+
+@pytest.mark.parametrize('mode', MODES)
+@pytest.mark.parametrize('threads', ('1', '3', '16'))
+@pytest.mark.parametrize('loop', LOOPS)
+def test_parallel_output_matches_sequential_loop(run_program, mode, threads, loop):
+    sequential = run_program({'main.sas': loop + '\n'}, mode, ('--threads', threads))
+    parallel = run_program({'main.sas': f'parallel {loop}\n'}, mode, ('--threads', threads))
+
+    assert sequential.returncode == 0, sequential.stdout + sequential.stderr
+    assert parallel.returncode == 0, parallel.stdout + parallel.stderr
+    assert parallel.stdout == sequential.stdout
+    assert len(parallel.stdout.splitlines()) == 100
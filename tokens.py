@@ -22,7 +22,9 @@ from constants import (
 class T:
     def __init__(self):
         self.name: str
-        self.kind: str
+        self.kind: int
+        # (line, column) of the first char, both starting at 1. Set by the Tokenizer
+        self.position: tuple[int, int]
 
 
 class T_EOF(T):
@@ -37,6 +39,12 @@ class T_SYMBOL(T):
         self.kind = K_SYMBOL
 
 
+class T_KEYWORD(T):
+    def __init__(self, name, kind):
+        self.name = name
+        self.kind = kind
+
+
 class T_LEFT_PAREN(T):
     def __init__(self):
         self.name = '('
@@ -45,7 +53,7 @@ class T_LEFT_PAREN(T):
 
 class T_RIGHT_PAREN(T):
     def __init__(self):
-        self.name = '('
+        self.name = ')'
         self.kind = K_RIGHT_PAREN
 
 
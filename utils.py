@@ -1,5 +1,6 @@
 import sys
 import random
+import struct
 from constants import CHARS_ARRAY
 
 
@@ -11,3 +12,30 @@ def generate_random_string(prefix, length):
 def error(text):
     sys.stderr.write(text + '\n')
     exit(1)
+
+
+def text_size(path):
+    """size of the .text section of an ELF64 executable or object"""
+    with open(path, 'rb') as f:
+        elf = f.read()
+
+    if elf[:4] != b'\x7fELF' or elf[4] != 2:
+        error(f'"{path}" is not an ELF64 file')
+
+    shoff, = struct.unpack_from('<Q', elf, 0x28)
+    shentsize, shnum, shstrndx = struct.unpack_from('<HHH', elf, 0x3a)
+
+    def section(index):
+        # sh_name, sh_type, sh_flags, sh_addr, sh_offset, sh_size
+        return struct.unpack_from('<IIQQQQ', elf, shoff + index * shentsize)
+
+    strings = section(shstrndx)[4]
+
+    for index in range(shnum):
+        name, _, _, _, offset, size = section(index)
+        end = elf.index(b'\x00', strings + name)
+
+        if elf[strings + name:end] == b'.text':
+            return size
+
+    return 0
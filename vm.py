@@ -0,0 +1,330 @@
+import sys
+from array import array
+from constants import (
+    NK_IMPORT,
+
+    IK_CONST,
+    IK_ADD,
+    IK_WRITE,
+    IK_CALL,
+    IK_JUMP,
+    IK_BRANCH,
+    IK_RETURN,
+    IK_EXIT,
+    IK_END,
+    IK_COUNT,
+    IK_ARGUMENT,
+    IK_PARALLEL,
+)
+from lower import Lowerer
+from passes import PassManager
+from pgo import module_tag
+from utils import error
+
+# The bytecode is selected from the same optimized IR as the native code, one
+# opcode per assembly instruction the Backend emits, so the output is
+# byte-identical to the native binary. Virtual registers live in stack slots
+# counted from the top of the stack, like [rsp+8*slot].
+OP_CONST = 0       # <slot> <value>
+OP_ADD = 1         # <slot> <value>
+OP_JCC = 2         # <condition> <slot> <value> <target>
+OP_JMP = 3         # <target>
+OP_WRITE = 4       # <text index>
+OP_CALL = 5        # <target>
+OP_ENTER = 6       # <slots>           sub rsp,8*slots
+OP_LEAVE = 7       # <slots>           add rsp,8*slots
+OP_RET = 8
+OP_EXIT = 9        # <code>
+OP_COUNT = 10      # <module> <counter>
+OP_ARGUMENTS = 11  # <start> <iterations>    mov r12,start / mov r13,iterations
+OP_ARGUMENT = 12   # <slot> <index>          mov [rsp+8*slot],r12 or r13
+OP_WRITE_INT = 13  # <slot>                  call __sas_format_int
+
+CONDITIONS = {
+    'l': 0,
+    'g': 1,
+    'le': 2,
+    'ge': 3,
+    'e': 4,
+    'ne': 5,
+}
+
+# return addresses share the stack with the slots, like on the real stack
+RETURN_BASE = 1 << 62
+STACK_LIMIT = (8 * 1024 * 1024) // 8
+
+
+class Label:
+    # placed in the code as (label,), referenced as the label itself
+    def __init__(self):
+        self.address = None
+
+
+class Lowering:
+    def __init__(self, passes=None, profile=None, threads=1):
+        self.passes = passes or PassManager()
+        self.profile = profile
+        self.threads = threads
+        self.module = None
+        self.code = []
+        self.fn_declarations = []
+        self.texts = []
+        self.text_references = {}
+        self.labels = {}
+
+    def text_reference(self, text):
+        if text not in self.text_references:
+            self.text_references[text] = len(self.texts)
+            self.texts.append(text.encode('utf-8'))
+
+        return self.text_references[text]
+
+    def function_label(self, name):
+        """name is the label of a fn, or the Function of a worker"""
+        if name not in self.labels:
+            self.labels[name] = Label()
+
+        return self.labels[name]
+
+    def select_function(self, function, fd):
+        """mirrors Backend.emit_function"""
+        labels = {id(block): Label() for block in function.blocks}
+        end = Label()
+
+        # workers have no name, the code running them refers to the function
+        if function.worker:
+            fd.append((self.function_label(function),))
+        elif function.label is not None:
+            fd.append((self.function_label(function.label),))
+
+        if function.registers > 0:
+            fd.extend((OP_ENTER, function.registers))
+
+        for i, block in enumerate(function.blocks):
+            following = function.blocks[i + 1] if i + 1 < len(function.blocks) else None
+
+            fd.append((labels[id(block)],))
+
+            for instruction in block.instructions:
+                if instruction.kind == IK_CONST:
+                    fd.extend((OP_CONST, instruction.register, instruction.value))
+                elif instruction.kind == IK_ADD:
+                    fd.extend((OP_ADD, instruction.register, instruction.value))
+                elif instruction.kind == IK_WRITE:
+                    text = ''
+
+                    for piece in instruction.pieces:
+                        if isinstance(piece, str):
+                            text += piece
+                            continue
+
+                        if len(text) > 0:
+                            fd.extend((OP_WRITE, self.text_reference(text)))
+                            text = ''
+
+                        fd.extend((OP_WRITE_INT, piece))
+
+                    if len(text) > 0:
+                        fd.extend((OP_WRITE, self.text_reference(text)))
+                elif instruction.kind == IK_CALL:
+                    fd.extend((OP_CALL, self.function_label(instruction.label)))
+                elif instruction.kind == IK_COUNT:
+                    module = list(self.profile.counters).index(module_tag(self.module))
+
+                    fd.extend((OP_COUNT, module, instruction.counter))
+                elif instruction.kind == IK_ARGUMENT:
+                    fd.extend((OP_ARGUMENT, instruction.register, instruction.index))
+                elif instruction.kind == IK_PARALLEL:
+                    # the chunks run one after the other, already in output order
+                    for start, iterations, _ in instruction.chunks:
+                        fd.extend((OP_ARGUMENTS, start, iterations))
+                        fd.extend((OP_CALL, self.function_label(instruction.worker)))
+                else:
+                    error(f'unhandled instruction kind {instruction.kind}')
+
+            terminator = block.terminator
+
+            if terminator.kind == IK_JUMP:
+                if terminator.target is not following:
+                    fd.extend((OP_JMP, labels[id(terminator.target)]))
+            elif terminator.kind == IK_BRANCH:
+                fd.extend((
+                    OP_JCC,
+                    CONDITIONS[terminator.condition],
+                    terminator.register,
+                    terminator.value,
+                    labels[id(terminator.then)]
+                ))
+
+                if terminator.otherwise is not following:
+                    fd.extend((OP_JMP, labels[id(terminator.otherwise)]))
+            elif terminator.kind in (IK_RETURN, IK_END):
+                if function.registers > 0:
+                    fd.extend((OP_LEAVE, function.registers))
+
+                if terminator.kind == IK_RETURN:
+                    fd.append(OP_RET)
+                elif following is not None:
+                    fd.extend((OP_JMP, end))
+            elif terminator.kind == IK_EXIT:
+                fd.extend((OP_EXIT, terminator.code))
+            else:
+                error(f'unhandled terminator kind {terminator.kind}')
+
+        fd.append((end,))
+
+    def lower_module(self, name, nodes, imports):
+        lowerer = Lowerer(name, imports, self.profile, self.threads)
+        self.module = name
+
+        for node in nodes:
+            if node.kind == NK_IMPORT:
+                lowerer.lower_import(node)
+                continue
+
+            for function in lowerer.lower_item(node):
+                self.passes.run(function)
+                self.select_function(
+                    function,
+                    self.code if function.label is None and not function.worker else self.fn_declarations
+                )
+
+        # only the functions the module defines, not the ones it imported
+        return {name: lowerer.fn_to_label[name] for name in lowerer.fn_definitions}
+
+    def lower(self, modules):
+        """modules come in dependency order, as returned by resolve_modules"""
+        exports = {}
+
+        for name, nodes, imported in modules:
+            exports[name] = self.lower_module(
+                name,
+                nodes,
+                {module_name: exports[module_name] for module_name in imported}
+            )
+
+        self.code.extend((OP_EXIT, 0))
+
+        items = self.code + self.fn_declarations
+        address = 0
+
+        for item in items:
+            if isinstance(item, tuple):
+                item[0].address = address
+            else:
+                address += 1
+
+        bytecode = array('q')
+
+        for item in items:
+            if isinstance(item, tuple):
+                continue
+
+            if isinstance(item, Label):
+                bytecode.append(item.address)
+            else:
+                bytecode.append(item)
+
+        return bytecode, self.texts
+
+    def counters(self):
+        """zeroed profile counters of every module, in the order of profile.counters"""
+        return [array('q', [0] * len(names)) for names in self.profile.counters.values()]
+
+
+def execute(bytecode, texts, out=None, counters=None, at_exit=None):
+    """runs the program and returns its exit code. counters are bumped by the
+    profile instrumentation, at_exit runs when the program exits by itself"""
+    if out is None:
+        out = sys.stdout.buffer
+
+    buffer = bytearray()
+    stack = []
+    arguments = [0, 0]
+    pc = 0
+
+    while True:
+        op = bytecode[pc]
+
+        if op == OP_WRITE:
+            buffer += texts[bytecode[pc + 1]]
+            pc += 2
+
+            if len(buffer) >= 65536:
+                out.write(buffer)
+                buffer.clear()
+        elif op == OP_JCC:
+            value = stack[-1 - bytecode[pc + 2]]
+            condition = bytecode[pc + 1]
+            right = bytecode[pc + 3]
+
+            if condition == 0:
+                taken = value < right
+            elif condition == 1:
+                taken = value > right
+            elif condition == 2:
+                taken = value <= right
+            elif condition == 3:
+                taken = value >= right
+            elif condition == 4:
+                taken = value == right
+            else:
+                taken = value != right
+
+            pc = bytecode[pc + 4] if taken else pc + 5
+        elif op == OP_ADD:
+            stack[-1 - bytecode[pc + 1]] += bytecode[pc + 2]
+            pc += 3
+        elif op == OP_CONST:
+            stack[-1 - bytecode[pc + 1]] = bytecode[pc + 2]
+            pc += 3
+        elif op == OP_JMP:
+            pc = bytecode[pc + 1]
+        elif op == OP_ENTER:
+            stack.extend([0] * bytecode[pc + 1])
+            pc += 2
+
+            if len(stack) > STACK_LIMIT:
+                break
+        elif op == OP_LEAVE:
+            del stack[len(stack) - bytecode[pc + 1]:]
+            pc += 2
+        elif op == OP_CALL:
+            stack.append(RETURN_BASE + pc + 2)
+            pc = bytecode[pc + 1]
+
+            if len(stack) > STACK_LIMIT:
+                break
+        elif op == OP_WRITE_INT:
+            buffer += str(stack[-1 - bytecode[pc + 1]]).encode('utf-8')
+            pc += 2
+        elif op == OP_ARGUMENTS:
+            arguments[0] = bytecode[pc + 1]
+            arguments[1] = bytecode[pc + 2]
+            pc += 3
+        elif op == OP_ARGUMENT:
+            stack[-1 - bytecode[pc + 1]] = arguments[bytecode[pc + 2]]
+            pc += 3
+        elif op == OP_COUNT:
+            counters[bytecode[pc + 1]][bytecode[pc + 2]] += 1
+            pc += 3
+        elif op == OP_RET:
+            if len(stack) == 0 or stack[-1] < RETURN_BASE:
+                break
+
+            pc = stack.pop() - RETURN_BASE
+        else:
+            out.write(buffer)
+            out.flush()
+
+            if at_exit is not None:
+                at_exit()
+
+            return bytecode[pc + 1] & 0xff
+
+    # the native binary crashes here, overflowing the stack
+    out.write(buffer)
+    out.flush()
+    sys.stderr.write('segmentation fault\n')
+
+    return 139